@@ -1,4 +1,4 @@
-from aiogram import Bot, types, F
+from aiogram import Bot, types, F, html
 from aiogram.filters import Command
 from aiogram.types import (
     InlineKeyboardMarkup, 
@@ -10,9 +10,14 @@ from aiogram.types import (
 from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from database import (
+from async_database import (
     get_all_categories,
-    get_all_products,
+    get_categories_page,
+    count_categories,
+    get_products_page,
+    count_products,
+    get_previous_page_cursor,
+    search_products,
     add_category,
     add_product,
     update_category,
@@ -20,12 +25,23 @@ from database import (
     delete_category,
     delete_product,
     get_products_by_category,
-    get_product
+    get_product,
+    count_outbox_orders,
+    get_dead_orders,
+    retry_dead_orders
 )
+from metrics import format_stats
+from async_database import run_in_db
+from catalog_io import import_catalog, export_catalog
+from photos import has_product_photo, send_product_photo
+from outbox import order_outbox
 from config import ADMIN_ID, IMAGE_FOLDER
+import asyncio
 import os
 import shutil
 import logging
+import tempfile
+from datetime import datetime
 from math import ceil
 
 # Настройка логирования
@@ -34,6 +50,15 @@ logger = logging.getLogger(__name__)
 
 # Константы для пагинации
 ITEMS_PER_PAGE = 5  # Количество элементов на странице
+SEARCH_RESULTS_LIMIT = 30  # Максимум товаров в результатах поиска
+
+# Кнопки главного меню админ-панели
+ADMIN_MENU_BUTTONS = [
+    "Управление категориями",
+    "Управление товарами",
+    "Выгрузка заказов",
+    "Выйти из админ-панели"
+]
 
 # Создаем папку для изображений, если ее нет
 os.makedirs(IMAGE_FOLDER, exist_ok=True)
@@ -49,6 +74,8 @@ class AdminStates(StatesGroup):
     waiting_for_edit_product_price = State()
     waiting_for_edit_product_image = State()
     waiting_for_edit_product_category = State()
+    waiting_for_import_file = State()
+    waiting_for_search_query = State()
 
 async def setup_admin_handlers(dp):
     """Настройка обработчиков для админ-панели"""
@@ -70,9 +97,8 @@ async def setup_admin_handlers(dp):
 
     def get_admin_keyboard():
         builder = ReplyKeyboardBuilder()
-        builder.row(KeyboardButton(text="Управление категориями"))
-        builder.row(KeyboardButton(text="Управление товарами"))
-        builder.row(KeyboardButton(text="Выйти из админ-панели"))
+        for text in ADMIN_MENU_BUTTONS:
+            builder.row(KeyboardButton(text=text))
         return builder.as_markup(resize_keyboard=True)
     
     def get_categories_admin_keyboard():
@@ -98,10 +124,22 @@ async def setup_admin_handlers(dp):
             text="Список товаров",
             callback_data="admin_list_products_page_0"
         ))
+        builder.add(InlineKeyboardButton(
+            text="Поиск товаров",
+            callback_data="admin_search_products"
+        ))
+        builder.add(InlineKeyboardButton(
+            text="Импорт товаров (CSV/JSONL)",
+            callback_data="admin_import_products"
+        ))
+        builder.add(InlineKeyboardButton(
+            text="Экспорт товаров (CSV)",
+            callback_data="admin_export_products"
+        ))
         builder.adjust(1)
         return builder.as_markup()
     
-    def get_category_actions_keyboard(category_id: str, page: int = 0):
+    def get_category_actions_keyboard(category_id: str, page: int = 0, after_id: int = 0):
         builder = InlineKeyboardBuilder()
         builder.add(InlineKeyboardButton(
             text="Изменить название",
@@ -113,12 +151,12 @@ async def setup_admin_handlers(dp):
         ))
         builder.add(InlineKeyboardButton(
             text="Назад к списку",
-            callback_data=f"admin_list_categories_page_{page}"
+            callback_data=f"admin_list_categories_page_{page}_{after_id}"
         ))
         builder.adjust(1)
         return builder.as_markup()
     
-    def get_product_actions_keyboard(product_id: int, page: int = 0):
+    def get_product_actions_keyboard(product_id: int, page: int = 0, after_id: int = 0):
         builder = InlineKeyboardBuilder()
         builder.add(InlineKeyboardButton(
             text="Изменить товар",
@@ -130,11 +168,21 @@ async def setup_admin_handlers(dp):
         ))
         builder.add(InlineKeyboardButton(
             text="Назад к списку",
-            callback_data=f"admin_list_products_page_{page}"
+            callback_data=f"admin_list_products_page_{page}_{after_id}"
         ))
         builder.adjust(1)
         return builder.as_markup()
     
+    def parse_page_callback(data: str):
+        """Возвращает номер страницы и ключ after_id из callback_data списка"""
+        parts = data.split("_")
+        try:
+            page = int(parts[4])
+            after_id = int(parts[5]) if len(parts) > 5 else 0
+        except (IndexError, ValueError):
+            return 0, 0
+        return page, after_id
+    
     def get_back_to_admin_keyboard():
         builder = InlineKeyboardBuilder()
         builder.add(InlineKeyboardButton(
@@ -143,14 +191,14 @@ async def setup_admin_handlers(dp):
         ))
         return builder.as_markup()
 
-    def build_pagination_keyboard(page: int, total_pages: int, prefix: str):
+    def build_pagination_keyboard(page: int, total_pages: int, prefix: str, prev_cursor: int, next_cursor: int):
         builder = InlineKeyboardBuilder()
         
-        # Горизонтальная пагинация
+        # Горизонтальная пагинация (в callback_data номер страницы и ключ, после которого она начинается)
         if page > 0:
             builder.add(InlineKeyboardButton(
                 text="⬅ Назад",
-                callback_data=f"{prefix}{page - 1}"
+                callback_data=f"{prefix}{page - 1}_{prev_cursor}"
             ))
         
         builder.add(InlineKeyboardButton(
@@ -161,7 +209,7 @@ async def setup_admin_handlers(dp):
         if page < total_pages - 1:
             builder.add(InlineKeyboardButton(
                 text="Вперед ➡",
-                callback_data=f"{prefix}{page + 1}"
+                callback_data=f"{prefix}{page + 1}_{next_cursor}"
             ))
         
         # Все кнопки пагинации в один ряд
@@ -180,6 +228,13 @@ async def setup_admin_handlers(dp):
             reply_markup=get_admin_keyboard()
         )
     
+    @dp.message(Command("stats"))
+    async def cmd_stats(message: types.Message):
+        if not is_admin(message.from_user.id):
+            return
+        
+        await message.answer(format_stats())
+    
     @dp.message(F.text == "Выйти из админ-панели")
     async def admin_exit(message: types.Message):
         if not is_admin(message.from_user.id):
@@ -210,6 +265,51 @@ async def setup_admin_handlers(dp):
             reply_markup=get_products_admin_keyboard()
         )
     
+    async def get_outbox_report():
+        """Текст и клавиатура с состоянием выгрузки заказов в Google Таблицу"""
+        counts = await count_outbox_orders()
+        text = (
+            "Выгрузка заказов в Google Таблицу:\n\n"
+            f"Ожидают: {counts.get('pending', 0)}\n"
+            f"Выгружено: {counts.get('sent', 0)}\n"
+            f"Не выгружено: {counts.get('dead', 0)}"
+        )
+        builder = InlineKeyboardBuilder()
+        dead_orders = await get_dead_orders()
+        if dead_orders:
+            text += "\n\nПоследние невыгруженные заказы:"
+            for order_id, user_id, attempts, last_error, created_at in dead_orders:
+                created = datetime.fromtimestamp(created_at).strftime("%Y-%m-%d %H:%M")
+                text += f"\n\n№{order_id} от {created}, покупатель {user_id}, попыток: {attempts}\n{html.quote(last_error or '')}"
+            builder.row(InlineKeyboardButton(
+                text="Повторить выгрузку",
+                callback_data="admin_retry_orders"
+            ))
+        builder.row(InlineKeyboardButton(
+            text="Вернуться в админ-панель",
+            callback_data="admin_back_to_main"
+        ))
+        return text, builder.as_markup()
+
+    @dp.message(F.text == "Выгрузка заказов")
+    async def admin_orders(message: types.Message):
+        if not is_admin(message.from_user.id):
+            return
+        
+        text, keyboard = await get_outbox_report()
+        await message.answer(text, reply_markup=keyboard)
+    
+    @dp.callback_query(F.data == "admin_retry_orders")
+    async def admin_retry_orders(callback: types.CallbackQuery):
+        if not is_admin(callback.from_user.id):
+            return
+        
+        count = await retry_dead_orders()
+        order_outbox.notify()
+        await callback.answer(f"Заказов возвращено в очередь: {count}")
+        text, keyboard = await get_outbox_report()
+        await callback.message.edit_text(text, reply_markup=keyboard)
+    
     @dp.callback_query(F.data == "admin_add_category")
     async def admin_add_category_callback(callback: types.CallbackQuery, state: FSMContext):
         if not is_admin(callback.from_user.id):
@@ -234,7 +334,7 @@ async def setup_admin_handlers(dp):
         data = await state.get_data()
         category_id = data.get("category_id")
         
-        if add_category(category_id, category_name):
+        if await add_category(category_id, category_name):
             await message.answer(
                 f"Категория '{category_name}' успешно добавлена!",
                 reply_markup=get_back_to_admin_keyboard()
@@ -252,42 +352,42 @@ async def setup_admin_handlers(dp):
         if not is_admin(callback.from_user.id):
             return
         
-        try:
-            page = int(callback.data.split("_")[-1])
-        except:
-            page = 0
+        page, after_id = parse_page_callback(callback.data)
         
-        categories = get_all_categories()
-        if not categories:
+        total_count = await count_categories()
+        current_categories = await get_categories_page(after_id, ITEMS_PER_PAGE) if total_count else []
+        if total_count and not current_categories:
+            # Страница исчезла после удаления категорий - начинаем сначала
+            page, after_id = 0, 0
+            current_categories = await get_categories_page(after_id, ITEMS_PER_PAGE)
+        if not current_categories:
             await callback.message.answer(
                 "Нет доступных категорий",
                 reply_markup=get_back_to_admin_keyboard()
             )
             return
         
-        total_pages = ceil(len(categories) / ITEMS_PER_PAGE)
-        if page >= total_pages:
-            page = total_pages - 1
-        
-        start_idx = page * ITEMS_PER_PAGE
-        end_idx = start_idx + ITEMS_PER_PAGE
-        current_categories = categories[start_idx:end_idx]
+        total_pages = max(ceil(total_count / ITEMS_PER_PAGE), page + 1)
+        prev_cursor = 0
+        if page > 0:
+            prev_cursor = await get_previous_page_cursor('categories', current_categories[0].id, ITEMS_PER_PAGE)
+        next_cursor = current_categories[-1].id
         
         text = f"Список категорий (Страница {page + 1}/{total_pages}):\n\n"
         for category in current_categories:
-            text += f"{category['name']} (ID: {category['category_id']})\n"
+            text += f"{category.name} (ID: {category.category_id})\n"
         
         # Создаем клавиатуру с пагинацией
         pagination_builder = build_pagination_keyboard(
-            page, total_pages, "admin_list_categories_page_"
+            page, total_pages, "admin_list_categories_page_", prev_cursor, next_cursor
         )
         
         # Создаем клавиатуру с категориями
         categories_builder = InlineKeyboardBuilder()
         for category in current_categories:
             categories_builder.add(InlineKeyboardButton(
-                text=category['name'],
-                callback_data=f"admin_category_{category['category_id']}_{page}"
+                text=category.name,
+                callback_data=f"admin_category_{category.category_id}_{page}_{after_id}"
             ))
         categories_builder.adjust(2)
         
@@ -312,20 +412,23 @@ async def setup_admin_handlers(dp):
         if not is_admin(callback.from_user.id):
             return
         
-        parts = callback.data.split("_")
-        category_id = parts[2]
-        page = int(parts[3]) if len(parts) > 3 else 0
+        # category_id может содержать "_", поэтому страницу и ключ берем с конца
+        category_id = callback.data[len("admin_category_"):]
+        page, after_id = 0, 0
+        parts = category_id.rsplit("_", 2)
+        if len(parts) == 3 and parts[1].isdigit() and parts[2].isdigit():
+            category_id, page, after_id = parts[0], int(parts[1]), int(parts[2])
         
-        categories = get_all_categories()
-        category = next((c for c in categories if c['category_id'] == category_id), None)
+        categories = await get_all_categories()
+        category = next((c for c in categories if c.category_id == category_id), None)
         
         if not category:
             await callback.answer("Категория не найдена")
             return
         
         await callback.message.answer(
-            f"Категория: {category['name']}\nID: {category['category_id']}",
-            reply_markup=get_category_actions_keyboard(category_id, page)
+            f"Категория: {category.name}\nID: {category.category_id}",
+            reply_markup=get_category_actions_keyboard(category_id, page, after_id)
         )
         await callback.answer()
     
@@ -334,7 +437,7 @@ async def setup_admin_handlers(dp):
         if not is_admin(callback.from_user.id):
             return
         
-        category_id = callback.data.split("_")[3]
+        category_id = callback.data[len("admin_edit_category_"):]
         await state.update_data(category_id=category_id)
         await callback.message.answer("Введите новое название категории:")
         await state.set_state(AdminStates.waiting_for_new_category_name)
@@ -346,7 +449,7 @@ async def setup_admin_handlers(dp):
         data = await state.get_data()
         category_id = data.get("category_id")
         
-        if update_category(category_id, new_name):
+        if await update_category(category_id, new_name):
             await message.answer(
                 f"Название категории успешно изменено на '{new_name}'!",
                 reply_markup=get_back_to_admin_keyboard()
@@ -364,17 +467,17 @@ async def setup_admin_handlers(dp):
         if not is_admin(callback.from_user.id):
             return
         
-        category_id = callback.data.split("_")[3]
-        categories = get_all_categories()
-        category = next((c for c in categories if c['category_id'] == category_id), None)
+        category_id = callback.data[len("admin_delete_category_"):]
+        categories = await get_all_categories()
+        category = next((c for c in categories if c.category_id == category_id), None)
         
         if not category:
             await callback.answer("Категория не найдена")
             return
         
-        if delete_category(category_id):
+        if await delete_category(category_id):
             await callback.message.answer(
-                f"Категория '{category['name']}' успешно удалена!",
+                f"Категория '{category.name}' успешно удалена!",
                 reply_markup=get_back_to_admin_keyboard()
             )
         else:
@@ -389,7 +492,7 @@ async def setup_admin_handlers(dp):
         if not is_admin(callback.from_user.id):
             return
         
-        categories = get_all_categories()
+        categories = await get_all_categories()
         if not categories:
             await callback.message.answer(
                 "Сначала создайте хотя бы одну категорию",
@@ -400,8 +503,8 @@ async def setup_admin_handlers(dp):
         builder = InlineKeyboardBuilder()
         for category in categories:
             builder.add(InlineKeyboardButton(
-                text=category['name'],
-                callback_data=f"admin_add_product_to_{category['category_id']}"
+                text=category.name,
+                callback_data=f"admin_add_product_to_{category.category_id}"
             ))
         builder.adjust(2)
         
@@ -416,7 +519,7 @@ async def setup_admin_handlers(dp):
         if not is_admin(callback.from_user.id):
             return
         
-        category_id = callback.data.split("_")[4]
+        category_id = callback.data[len("admin_add_product_to_"):]
         await state.update_data(category_id=category_id)
         await callback.message.answer("Введите название товара:")
         await state.set_state(AdminStates.waiting_for_product_name)
@@ -446,13 +549,15 @@ async def setup_admin_handlers(dp):
         price = data.get("price")
         category_id = data.get("category_id")
         image_filename = None
+        image_file_id = None
         
         if message.text and message.text.lower() == "нет":
             image_filename = ""
         elif message.photo:
             try:
                 filename_base = "".join(c for c in product_name if c.isalnum())
-                image_filename = await save_photo(message.bot, message.photo[-1].file_id, filename_base)
+                image_file_id = message.photo[-1].file_id
+                image_filename = await save_photo(message.bot, image_file_id, filename_base)
             except Exception as e:
                 await message.answer(f"Ошибка при сохранении изображения: {e}")
                 return
@@ -460,7 +565,7 @@ async def setup_admin_handlers(dp):
             await message.answer("Пожалуйста, отправьте фото или 'нет'")
             return
         
-        if add_product(product_name, price, image_filename, category_id):
+        if await add_product(product_name, price, image_filename, category_id, image_file_id):
             await message.answer(
                 f"Товар '{product_name}' успешно добавлен!",
                 reply_markup=get_back_to_admin_keyboard()
@@ -473,48 +578,142 @@ async def setup_admin_handlers(dp):
         
         await state.clear()
     
+    @dp.callback_query(F.data == "admin_search_products")
+    async def admin_search_products_callback(callback: types.CallbackQuery, state: FSMContext):
+        if not is_admin(callback.from_user.id):
+            return
+        
+        await callback.message.answer("Введите название товара для поиска:")
+        await state.set_state(AdminStates.waiting_for_search_query)
+        await callback.answer()
+    
+    @dp.message(AdminStates.waiting_for_search_query)
+    async def admin_process_search_query(message: types.Message, state: FSMContext):
+        if not message.text:
+            await message.answer("Пожалуйста, введите название товара")
+            return
+        
+        await state.clear()
+        products = await search_products(message.text.strip(), SEARCH_RESULTS_LIMIT)
+        if not products:
+            await message.answer("Ничего не найдено", reply_markup=get_back_to_admin_keyboard())
+            return
+        
+        text = "Найденные товары:\n\n"
+        builder = InlineKeyboardBuilder()
+        for product in products:
+            text += f"• {product.name} - {product.price}Р (ID: {product.id})\n"
+            builder.add(InlineKeyboardButton(
+                text=product.name,
+                callback_data=f"admin_product_{product.id}"
+            ))
+        builder.adjust(1)
+        
+        await message.answer(text, reply_markup=builder.as_markup())
+    
+    @dp.callback_query(F.data == "admin_import_products")
+    async def admin_import_products_callback(callback: types.CallbackQuery, state: FSMContext):
+        if not is_admin(callback.from_user.id):
+            return
+        
+        await callback.message.answer(
+            "Отправьте файл каталога .csv или .jsonl с колонками:\n"
+            "id (необязательно), name, price, image_url, category_id, category_name"
+        )
+        await state.set_state(AdminStates.waiting_for_import_file)
+        await callback.answer()
+    
+    @dp.message(AdminStates.waiting_for_import_file)
+    async def admin_process_import_file(message: types.Message, state: FSMContext):
+        file_name = message.document.file_name if message.document else None
+        ext = os.path.splitext(file_name or "")[1].lower()
+        if ext not in (".csv", ".jsonl", ".ndjson", ".json"):
+            await message.answer("Пожалуйста, отправьте файл .csv или .jsonl")
+            return
+        
+        await state.clear()
+        status_message = await message.answer("Импорт начат...")
+        loop = asyncio.get_running_loop()
+        
+        def report_progress(stats):
+            # Вызывается из потока базы данных после каждой пачки
+            asyncio.run_coroutine_threadsafe(
+                status_message.edit_text(
+                    f"Импорт... Обработано строк: {stats['rows']}, импортировано: {stats['imported']}"
+                ),
+                loop
+            )
+        
+        try:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                path = os.path.join(tmp_dir, f"import{ext}")
+                await message.bot.download(message.document, destination=path)
+                stats = await run_in_db(import_catalog, path, progress=report_progress)
+        except Exception as e:
+            logger.error(f"Ошибка при импорте каталога: {e}")
+            await message.answer(f"Ошибка при импорте каталога: {e}", reply_markup=get_back_to_admin_keyboard())
+            return
+        
+        await message.answer(
+            f"Импорт завершен!\nСтрок: {stats['rows']}\nИмпортировано: {stats['imported']}\nОшибок: {stats['errors']}",
+            reply_markup=get_back_to_admin_keyboard()
+        )
+    
+    @dp.callback_query(F.data == "admin_export_products")
+    async def admin_export_products_callback(callback: types.CallbackQuery):
+        if not is_admin(callback.from_user.id):
+            return
+        
+        await callback.answer("Готовим файл...")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "catalog.csv")
+            count = await run_in_db(export_catalog, path)
+            await callback.message.answer_document(
+                FSInputFile(path),
+                caption=f"Выгружено товаров: {count}"
+            )
 
     @dp.callback_query(F.data.startswith("admin_list_products_page_"))
     async def admin_list_products_callback(callback: types.CallbackQuery):
         if not is_admin(callback.from_user.id):
             return
         
-        try:
-            page = int(callback.data.split("_")[-1])
-        except:
-            page = 0
+        page, after_id = parse_page_callback(callback.data)
         
-        products = get_all_products()
-        if not products:
+        total_count = await count_products()
+        current_products = await get_products_page(after_id, ITEMS_PER_PAGE) if total_count else []
+        if total_count and not current_products:
+            # Страница исчезла после удаления товаров - начинаем сначала
+            page, after_id = 0, 0
+            current_products = await get_products_page(after_id, ITEMS_PER_PAGE)
+        if not current_products:
             await callback.message.answer(
                 "Нет доступных товаров",
                 reply_markup=get_back_to_admin_keyboard()
             )
             return
         
-        total_pages = ceil(len(products) / ITEMS_PER_PAGE)
-        if page >= total_pages:
-            page = total_pages - 1
-        
-        start_idx = page * ITEMS_PER_PAGE
-        end_idx = start_idx + ITEMS_PER_PAGE
-        current_products = products[start_idx:end_idx]
+        total_pages = max(ceil(total_count / ITEMS_PER_PAGE), page + 1)
+        prev_cursor = 0
+        if page > 0:
+            prev_cursor = await get_previous_page_cursor('products', current_products[0].id, ITEMS_PER_PAGE)
+        next_cursor = current_products[-1].id
         
         text = "Список товаров:\n\n"
         for product in current_products:
-            text += f"• {product['name']} - {product['price']}Р (ID: {product['id']})\n"
+            text += f"• {product.name} - {product.price}Р (ID: {product.id})\n"
         
         # Создаем клавиатуру с пагинацией (горизонтально)
         pagination_builder = build_pagination_keyboard(
-            page, total_pages, "admin_list_products_page_"
+            page, total_pages, "admin_list_products_page_", prev_cursor, next_cursor
         )
         
         # Создаем клавиатуру с товарами (горизонтально)
         products_builder = InlineKeyboardBuilder()
         for product in current_products:
             products_builder.add(InlineKeyboardButton(
-                text=f"{product['name']}",
-                callback_data=f"admin_product_{product['id']}_{page}"
+                text=f"{product.name}",
+                callback_data=f"admin_product_{product.id}_{page}_{after_id}"
             ))
         
         # 5 товара в ряд
@@ -544,29 +743,28 @@ async def setup_admin_handlers(dp):
         parts = callback.data.split("_")
         product_id = int(parts[2])
         page = int(parts[3]) if len(parts) > 3 else 0
+        after_id = int(parts[4]) if len(parts) > 4 else 0
         
-        product = get_product(product_id)
+        product = await get_product(product_id)
         
         if not product:
             await callback.answer("Товар не найден")
             return
         
         # Показываем изображение товара, если оно есть
-        image_path = os.path.join(IMAGE_FOLDER, product['image_url']) if product.get('image_url') else None
-        
-        if image_path and os.path.exists(image_path):
-            photo = FSInputFile(image_path)
+        if has_product_photo(product):
             await callback.message.delete()
-            sent_message = await callback.bot.send_photo(
-                chat_id=callback.message.chat.id,
-                photo=photo,
-                caption=f"Товар: {product['name']}\nЦена: {product['price']}Р\nID: {product_id}",
-                reply_markup=get_product_actions_keyboard(product_id, page)
+            sent_message = await send_product_photo(
+                callback.bot,
+                callback.message.chat.id,
+                product,
+                caption=f"Товар: {product.name}\nЦена: {product.price}Р\nID: {product_id}",
+                reply_markup=get_product_actions_keyboard(product_id, page, after_id)
             )
         else:
             await callback.message.edit_text(
-                f"Товар: {product['name']}\nЦена: {product['price']}Р\nID: {product_id}",
-                reply_markup=get_product_actions_keyboard(product_id, page)
+                f"Товар: {product.name}\nЦена: {product.price}Р\nID: {product_id}",
+                reply_markup=get_product_actions_keyboard(product_id, page, after_id)
             )
         
         await callback.answer()
@@ -577,7 +775,7 @@ async def setup_admin_handlers(dp):
             return
         
         product_id = int(callback.data.split("_")[3])
-        product = get_product(product_id)
+        product = await get_product(product_id)
         
         if not product:
             await callback.answer("Товар не найден")
@@ -625,8 +823,12 @@ async def setup_admin_handlers(dp):
         data = await state.get_data()
         product_id = data.get("product_id")
         
-        if update_product(product_id, name=message.text):
-            await message.answer("Название товара успешно изменено!", reply_markup=get_back_to_admin_keyboard())
+        product = await update_product(product_id, name=message.text)
+        if product:
+            await message.answer(
+                f"Название товара успешно изменено на '{product.name}'!",
+                reply_markup=get_back_to_admin_keyboard()
+            )
         else:
             await message.answer("Ошибка при изменении названия", reply_markup=get_back_to_admin_keyboard())
         
@@ -645,8 +847,12 @@ async def setup_admin_handlers(dp):
             data = await state.get_data()
             product_id = data.get("product_id")
             
-            if update_product(product_id, price=new_price):
-                await message.answer("Цена товара успешно изменена!", reply_markup=get_back_to_admin_keyboard())
+            product = await update_product(product_id, price=new_price)
+            if product:
+                await message.answer(
+                    f"Цена товара '{product.name}' успешно изменена на {product.price}Р!",
+                    reply_markup=get_back_to_admin_keyboard()
+                )
             else:
                 await message.answer("Ошибка при изменении цены", reply_markup=get_back_to_admin_keyboard())
         except ValueError:
@@ -665,7 +871,7 @@ async def setup_admin_handlers(dp):
     async def process_edit_product_image(message: types.Message, state: FSMContext):
         data = await state.get_data()
         product_id = data.get("product_id")
-        product = get_product(product_id)
+        product = await get_product(product_id)
         
         if not product:
             await message.answer("Товар не найден")
@@ -673,22 +879,25 @@ async def setup_admin_handlers(dp):
             return
         
         new_image = None
+        # Фото уже загружено в Telegram, поэтому его file_id можно сразу сохранить
+        new_file_id = None
         
         if message.text and message.text.lower() == "нет":
             # Удаляем старое изображение
-            if product.get('image_url'):
-                old_image_path = os.path.join(IMAGE_FOLDER, product['image_url'])
+            if product.image_url:
+                old_image_path = os.path.join(IMAGE_FOLDER, product.image_url)
                 if os.path.exists(old_image_path):
                     os.remove(old_image_path)
             new_image = ""
         elif message.photo:
             try:
                 filename_base = f"product_{product_id}"
-                new_image = await save_photo(message.bot, message.photo[-1].file_id, filename_base)
+                new_file_id = message.photo[-1].file_id
+                new_image = await save_photo(message.bot, new_file_id, filename_base)
                 
                 # Удаляем старое изображение
-                if product.get('image_url'):
-                    old_image_path = os.path.join(IMAGE_FOLDER, product['image_url'])
+                if product.image_url:
+                    old_image_path = os.path.join(IMAGE_FOLDER, product.image_url)
                     if os.path.exists(old_image_path):
                         os.remove(old_image_path)
             except Exception as e:
@@ -698,7 +907,7 @@ async def setup_admin_handlers(dp):
             await message.answer("Пожалуйста, отправьте фото или 'нет'")
             return
         
-        if update_product(product_id, image_url=new_image):
+        if await update_product(product_id, image_url=new_image, image_file_id=new_file_id):
             await message.answer("Изображение товара успешно изменено!", reply_markup=get_back_to_admin_keyboard())
         else:
             await message.answer("Ошибка при изменении изображения", reply_markup=get_back_to_admin_keyboard())
@@ -707,7 +916,7 @@ async def setup_admin_handlers(dp):
     
     @dp.callback_query(F.data == "edit_product_category")
     async def edit_product_category_handler(callback: types.CallbackQuery, state: FSMContext):
-        categories = get_all_categories()
+        categories = await get_all_categories()
         if not categories:
             await callback.answer("Нет доступных категорий")
             return
@@ -715,8 +924,8 @@ async def setup_admin_handlers(dp):
         builder = InlineKeyboardBuilder()
         for category in categories:
             builder.add(InlineKeyboardButton(
-                text=category['name'],
-                callback_data=f"set_product_category_{category['category_id']}"
+                text=category.name,
+                callback_data=f"set_product_category_{category.category_id}"
             ))
         builder.adjust(2)
         
@@ -729,12 +938,16 @@ async def setup_admin_handlers(dp):
     
     @dp.callback_query(F.data.startswith("set_product_category_"), AdminStates.waiting_for_edit_product_category)
     async def set_product_category_handler(callback: types.CallbackQuery, state: FSMContext):
-        new_category_id = callback.data.split("_")[3]
+        new_category_id = callback.data[len("set_product_category_"):]
         data = await state.get_data()
         product_id = data.get("product_id")
         
-        if update_product(product_id, category_id=new_category_id):
-            await callback.message.answer("Категория товара успешно изменена!", reply_markup=get_back_to_admin_keyboard())
+        product = await update_product(product_id, category_id=new_category_id)
+        if product:
+            await callback.message.answer(
+                f"Категория товара '{product.name}' успешно изменена на '{product.category_name}'!",
+                reply_markup=get_back_to_admin_keyboard()
+            )
         else:
             await callback.message.answer("Ошибка при изменении категории", reply_markup=get_back_to_admin_keyboard())
         
@@ -747,20 +960,20 @@ async def setup_admin_handlers(dp):
             return
         
         product_id = int(callback.data.split("_")[3])
-        product = get_product(product_id)
+        product = await get_product(product_id)
         
         if not product:
             await callback.answer("Товар не найден")
             return
         
-        if product.get('image_url'):
-            image_path = os.path.join(IMAGE_FOLDER, product['image_url'])
+        if product.image_url:
+            image_path = os.path.join(IMAGE_FOLDER, product.image_url)
             if os.path.exists(image_path):
                 os.remove(image_path)
         
-        if delete_product(product_id):
+        if await delete_product(product_id):
             await callback.message.answer(
-                f"Товар '{product['name']}' успешно удален!",
+                f"Товар '{product.name}' успешно удален!",
                 reply_markup=get_back_to_admin_keyboard()
             )
         else:
@@ -0,0 +1,160 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, Optional, List, Tuple
+
+import database
+from models import Category, Product
+from catalog_cache import catalog_cache
+from config import DB_POOL_SIZE
+
+# Запросы к SQLite блокирующие, поэтому выполняем их в отдельных потоках,
+# чтобы не останавливать цикл событий бота. Потоков столько же, сколько
+# соединений в пуле, так что каждому потоку всегда достается соединение.
+_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="db")
+
+async def run_in_db(func, *args, **kwargs):
+    """Выполняет синхронную функцию работы с базой данных в пуле потоков"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, partial(func, *args, **kwargs))
+
+async def initialize_database():
+    await run_in_db(database.initialize_database)
+
+async def add_category(category_id: str, name: str) -> bool:
+    return await run_in_db(database.add_category, category_id, name)
+
+async def add_product(
+    name: str,
+    price: int,
+    image_url: Optional[str],
+    category_id: str,
+    image_file_id: Optional[str] = None
+) -> bool:
+    return await run_in_db(database.add_product, name, price, image_url, category_id, image_file_id)
+
+async def get_categories() -> Dict[str, str]:
+    categories = catalog_cache.get_categories()
+    if categories is None:
+        version = catalog_cache.version
+        categories = await run_in_db(database.get_categories)
+        catalog_cache.set_categories(categories, version)
+    return categories
+
+async def get_all_categories() -> List[Category]:
+    return await run_in_db(database.get_all_categories)
+
+async def get_categories_page(after_id: int = 0, limit: int = 5) -> List[Category]:
+    return await run_in_db(database.get_categories_page, after_id, limit)
+
+async def count_categories() -> int:
+    return await run_in_db(database.count_categories)
+
+async def get_products_by_category(category_id: str) -> List[Product]:
+    products = catalog_cache.get_products_by_category(category_id)
+    if products is None:
+        version = catalog_cache.version
+        products = await run_in_db(database.get_products_by_category, category_id)
+        catalog_cache.set_products_by_category(category_id, products, version)
+    return products
+
+async def get_all_products() -> List[Product]:
+    return await run_in_db(database.get_all_products)
+
+async def get_products_page(after_id: int = 0, limit: int = 5) -> List[Product]:
+    return await run_in_db(database.get_products_page, after_id, limit)
+
+async def count_products() -> int:
+    return await run_in_db(database.count_products)
+
+async def get_previous_page_cursor(table: str, first_id: int, limit: int) -> int:
+    return await run_in_db(database.get_previous_page_cursor, table, first_id, limit)
+
+async def get_product(product_id: int) -> Optional[Product]:
+    product = catalog_cache.get_product(product_id)
+    if product is None:
+        version = catalog_cache.version
+        product = await run_in_db(database.get_product, product_id)
+        if product:
+            catalog_cache.set_product(product, version)
+    return product
+
+async def get_products(product_ids) -> Dict[int, Product]:
+    products, missing = catalog_cache.get_products(dict.fromkeys(product_ids))
+    if missing:
+        version = catalog_cache.version
+        loaded = await run_in_db(database.get_products, missing)
+        catalog_cache.set_products(loaded, version)
+        products.update(loaded)
+    return products
+
+async def search_products(text: str, limit: int = 20) -> List[Product]:
+    return await run_in_db(database.search_products, text, limit)
+
+async def update_category(category_id: str, new_name: str) -> bool:
+    return await run_in_db(database.update_category, category_id, new_name)
+
+async def delete_category(category_id: str) -> bool:
+    return await run_in_db(database.delete_category, category_id)
+
+async def delete_product(product_id: int) -> bool:
+    return await run_in_db(database.delete_product, product_id)
+
+async def update_product(
+    product_id: int,
+    name: Optional[str] = None,
+    price: Optional[int] = None,
+    image_url: Optional[str] = None,
+    category_id: Optional[str] = None,
+    image_file_id: Optional[str] = None
+) -> Optional[Product]:
+    return await run_in_db(
+        database.update_product,
+        product_id,
+        name=name,
+        price=price,
+        image_url=image_url,
+        category_id=category_id,
+        image_file_id=image_file_id
+    )
+
+async def set_product_file_id(product_id: int, image_url: str, file_id: str) -> bool:
+    return await run_in_db(database.set_product_file_id, product_id, image_url, file_id)
+
+async def load_session(user_id: int) -> Optional[str]:
+    return await run_in_db(database.load_session, user_id)
+
+async def save_sessions(sessions: List[Tuple[int, str]]) -> bool:
+    return await run_in_db(database.save_sessions, sessions)
+
+async def load_fsm_record(key: str) -> Optional[Tuple[Optional[str], str]]:
+    return await run_in_db(database.load_fsm_record, key)
+
+async def save_fsm_records(records: List[Tuple[str, Optional[str], str]], deleted_keys: List[str]) -> bool:
+    return await run_in_db(database.save_fsm_records, records, deleted_keys)
+
+async def enqueue_order(user_id: int, payload: str) -> Optional[int]:
+    return await run_in_db(database.enqueue_order, user_id, payload)
+
+async def claim_due_orders(limit: int, lease: int) -> List[Tuple[int, str, int]]:
+    return await run_in_db(database.claim_due_orders, limit, lease)
+
+async def mark_orders_sent(order_ids: List[int]) -> bool:
+    return await run_in_db(database.mark_orders_sent, order_ids)
+
+async def mark_order_failed(order_id: int, error: str, next_attempt_at: Optional[int]) -> bool:
+    return await run_in_db(database.mark_order_failed, order_id, error, next_attempt_at)
+
+async def count_outbox_orders() -> Dict[str, int]:
+    return await run_in_db(database.count_outbox_orders)
+
+async def get_dead_orders(limit: int = 10) -> List[Tuple[int, int, int, Optional[str], int]]:
+    return await run_in_db(database.get_dead_orders, limit)
+
+async def retry_dead_orders() -> int:
+    return await run_in_db(database.retry_dead_orders)
+
+async def close_database():
+    """Дожидается завершения запросов и закрывает соединения"""
+    _executor.shutdown(wait=True)
+    database.close_database()
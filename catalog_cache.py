@@ -0,0 +1,169 @@
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import metrics
+from models import Product
+
+class CatalogCache:
+    """Кэш каталога в памяти процесса.
+
+    Каталог меняется только через админ-панель, поэтому категории и товары
+    читаются из базы один раз и хранятся до первого изменения. Любое успешное
+    изменение каталога увеличивает версию и сбрасывает кэш. Значение,
+    загруженное из базы, сохраняется только если версия за время загрузки
+    не изменилась, чтобы не положить в кэш устаревшие данные.
+
+    При запуске нескольких воркеров кэш связывается с общим счетчиком
+    изменений (share_version): изменение каталога в одном процессе
+    сбрасывает кэш в остальных при следующем обращении.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self._categories: Optional[Dict[str, str]] = None
+        self._products_by_category: Dict[str, List[Product]] = {}
+        self._products: Dict[int, Product] = {}
+        self._shared_version = None
+        self._seen_shared_version = 0
+
+    def share_version(self, shared_version):
+        """Связывает кэш с общим для нескольких процессов счетчиком изменений"""
+        with self._lock:
+            self._shared_version = shared_version
+            self._seen_shared_version = shared_version.value
+
+    def _sync(self):
+        # Каталог изменили в другом процессе - наши данные устарели
+        if self._shared_version is not None and self._shared_version.value != self._seen_shared_version:
+            self._seen_shared_version = self._shared_version.value
+            self._clear()
+
+    def _publish(self):
+        if self._shared_version is not None:
+            with self._shared_version.get_lock():
+                self._shared_version.value += 1
+                self._seen_shared_version = self._shared_version.value
+
+    def _clear(self):
+        self.version += 1
+        self._categories = None
+        self._products_by_category.clear()
+        self._products.clear()
+
+    def current_version(self) -> int:
+        """Версия каталога с учетом изменений в других процессах"""
+        with self._lock:
+            self._sync()
+            return self.version
+
+    def _lookup(self, value):
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def get_categories(self) -> Optional[Dict[str, str]]:
+        with self._lock:
+            self._sync()
+            return self._lookup(self._categories)
+
+    def set_categories(self, categories: Dict[str, str], version: int):
+        with self._lock:
+            if version == self.version:
+                self._categories = categories
+
+    def get_products_by_category(self, category_id: str) -> Optional[List[Product]]:
+        with self._lock:
+            self._sync()
+            return self._lookup(self._products_by_category.get(category_id))
+
+    def set_products_by_category(self, category_id: str, products: List[Product], version: int):
+        with self._lock:
+            if version == self.version:
+                self._products_by_category[category_id] = products
+                # Список содержит полные записи, поэтому заодно заполняем кэш товаров
+                for product in products:
+                    self._products[product.id] = product
+
+    def get_product(self, product_id: int) -> Optional[Product]:
+        with self._lock:
+            self._sync()
+            return self._lookup(self._products.get(product_id))
+
+    def set_product(self, product: Product, version: int):
+        with self._lock:
+            if version == self.version:
+                self._products[product.id] = product
+
+    def get_products(self, product_ids) -> Tuple[Dict[int, Product], List[int]]:
+        """Возвращает найденные в кэше товары и список отсутствующих id"""
+        found = {}
+        missing = []
+        with self._lock:
+            self._sync()
+            for product_id in product_ids:
+                product = self._lookup(self._products.get(product_id))
+                if product is None:
+                    missing.append(product_id)
+                else:
+                    found[product_id] = product
+        return found, missing
+
+    def set_products(self, products: Dict[int, Product], version: int):
+        with self._lock:
+            if version == self.version:
+                self._products.update(products)
+
+    def patch_product(self, product: Product):
+        """Обновляет измененный товар в кэше без полного сброса.
+
+        Списки категорий, в которых товар был или оказался, сбрасываются:
+        могли измениться состав и порядок сортировки по цене.
+        """
+        with self._lock:
+            self._sync()
+            self._publish()
+            self.version += 1
+            stale = [
+                category_id
+                for category_id, products in self._products_by_category.items()
+                if category_id == product.category or any(p.id == product.id for p in products)
+            ]
+            for category_id in stale:
+                del self._products_by_category[category_id]
+            self._products[product.id] = product
+
+    def set_file_id(self, product_id: int, image_url: str, file_id: str):
+        """Запоминает file_id фото товара.
+
+        Каталог при этом не меняется, поэтому версия не увеличивается,
+        а списки категорий получат file_id при следующей загрузке.
+        """
+        with self._lock:
+            product = self._products.get(product_id)
+            if product is not None and product.image_url == image_url:
+                self._products[product_id] = product._replace(image_file_id=file_id)
+
+    def invalidate(self):
+        """Сбрасывает кэш после изменения каталога"""
+        with self._lock:
+            self._publish()
+            self._clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'version': self.version,
+                'hits': self.hits,
+                'misses': self.misses,
+                'categories': len(self._categories or {}),
+                'category_lists': len(self._products_by_category),
+                'products': len(self._products)
+            }
+
+catalog_cache = CatalogCache()
+metrics.register("Кэш каталога", catalog_cache.stats)
@@ -0,0 +1,172 @@
+import argparse
+import csv
+import json
+import logging
+import os
+from typing import Callable, Dict, Iterator, Optional, Union
+
+import database
+
+logger = logging.getLogger(__name__)
+
+# Колонки файла каталога. id необязателен: без него товар ищется по
+# паре (category_id, name), category_name нужен только для новых категорий
+FIELDS = ['id', 'name', 'price', 'image_url', 'category_id', 'category_name']
+
+# Количество строк в одной транзакции
+IMPORT_BATCH_SIZE = 1000
+
+def _file_format(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.csv':
+        return 'csv'
+    if ext in ('.jsonl', '.ndjson', '.json'):
+        return 'jsonl'
+    raise ValueError(f"Неподдерживаемый формат файла: {path} (нужен .csv или .jsonl)")
+
+def read_catalog_rows(path: str) -> Iterator[Union[Dict, str]]:
+    """Построчно читает файл каталога, не загружая его в память целиком.
+
+    Строки JSONL возвращаются как текст и разбираются в parse_catalog_row,
+    чтобы одна испорченная строка пропускалась, а не прерывала импорт.
+    """
+    if _file_format(path) == 'csv':
+        with open(path, encoding='utf-8-sig', newline='') as f:
+            yield from csv.DictReader(f)
+    else:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield line
+
+def _clean(value) -> Optional[str]:
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+def parse_catalog_row(row: Union[Dict, str]) -> Dict:
+    """Проверяет строку файла и приводит ее к виду для import_catalog_batch"""
+    if isinstance(row, str):
+        row = json.loads(row)
+    if not isinstance(row, dict):
+        raise ValueError("строка не является объектом JSON")
+    name = _clean(row.get('name'))
+    category_id = _clean(row.get('category_id'))
+    if not name:
+        raise ValueError("не указано название товара")
+    if not category_id:
+        raise ValueError("не указана категория")
+    product_id = _clean(row.get('id'))
+    return {
+        'id': int(product_id) if product_id else None,
+        'name': name,
+        'price': int(str(row.get('price')).strip()),
+        'image_url': _clean(row.get('image_url')),
+        'category_id': category_id,
+        'category_name': _clean(row.get('category_name'))
+    }
+
+def import_catalog(
+    path: str,
+    batch_size: int = IMPORT_BATCH_SIZE,
+    progress: Optional[Callable[[Dict[str, int]], None]] = None
+) -> Dict[str, int]:
+    """Импортирует каталог из CSV/JSONL пачками по batch_size строк"""
+    stats = {'rows': 0, 'imported': 0, 'errors': 0}
+    categories: Dict[str, Optional[str]] = {}
+    products = []
+
+    def flush():
+        if not products:
+            return
+        if database.import_catalog_batch(categories, products):
+            stats['imported'] += len(products)
+        else:
+            stats['errors'] += len(products)
+        categories.clear()
+        products.clear()
+        if progress:
+            progress(dict(stats))
+
+    for line_number, row in enumerate(read_catalog_rows(path), start=1):
+        stats['rows'] += 1
+        try:
+            product = parse_catalog_row(row)
+        except (ValueError, TypeError) as e:
+            logger.warning(f"Строка {line_number} пропущена: {e}")
+            stats['errors'] += 1
+            continue
+        if product['category_name'] or product['category_id'] not in categories:
+            categories[product['category_id']] = product['category_name']
+        products.append(product)
+        if len(products) >= batch_size:
+            flush()
+    flush()
+    return stats
+
+def export_catalog(
+    path: str,
+    batch_size: int = IMPORT_BATCH_SIZE,
+    progress: Optional[Callable[[int], None]] = None
+) -> int:
+    """Выгружает каталог в CSV/JSONL, читая товары постранично по id"""
+    file_format = _file_format(path)
+    exported = 0
+    with open(path, 'w', encoding='utf-8-sig' if file_format == 'csv' else 'utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS) if file_format == 'csv' else None
+        if writer:
+            writer.writeheader()
+        after_id = 0
+        while True:
+            page = database.get_products_page(after_id, batch_size)
+            if not page:
+                break
+            for product in page:
+                row = {
+                    'id': product.id,
+                    'name': product.name,
+                    'price': product.price,
+                    'image_url': product.image_url or '',
+                    'category_id': product.category,
+                    'category_name': product.category_name
+                }
+                if writer:
+                    writer.writerow(row)
+                else:
+                    f.write(json.dumps(row, ensure_ascii=False) + '\n')
+            exported += len(page)
+            after_id = page[-1].id
+            if progress:
+                progress(exported)
+    return exported
+
+def main():
+    parser = argparse.ArgumentParser(description="Импорт и экспорт каталога товаров (CSV/JSONL)")
+    parser.add_argument('command', choices=['import', 'export'])
+    parser.add_argument('path', help="Путь к файлу .csv или .jsonl")
+    parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    database.create_tables()
+    database.apply_migrations()
+
+    if args.command == 'import':
+        stats = import_catalog(
+            args.path,
+            args.batch_size,
+            progress=lambda s: print(f"Обработано строк: {s['rows']}, импортировано: {s['imported']}")
+        )
+        print(f"Импорт завершен. Строк: {stats['rows']}, импортировано: {stats['imported']}, ошибок: {stats['errors']}")
+        # Кэш каталога и клавиатуры запущенного бота сбрасываются только при изменениях в его процессе
+        print("Если бот запущен, перезапустите его, чтобы он показал новый каталог, "
+              "или импортируйте файл через админ-панель")
+    else:
+        count = export_catalog(args.path, args.batch_size, progress=lambda n: print(f"Выгружено товаров: {n}"))
+        print(f"Экспорт завершен. Товаров: {count}")
+    database.close_database()
+
+if __name__ == "__main__":
+    main()
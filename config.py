@@ -4,3 +4,43 @@ GOOGLE_SHEETS_CREDENTIALS_FILE = ''  # Путь к файлу с учетным
 GOOGLE_SHEET_NAME = ''         # Название таблицы
 GOOGLE_SHEET_WORKSHEET = ''                    # Название листа в таблице
 IMAGE_FOLDER = ''
+DB_POOL_SIZE = 4                # Количество соединений с базой данных (и потоков для запросов)
+DB_PATH = 'shop.db'             # Путь к файлу базы данных
+DB_PRAGMAS = {                  # Настройки SQLite, применяемые к каждому соединению
+    'journal_mode': 'WAL',      # Чтение не блокируется записью из админ-панели
+    'synchronous': 'NORMAL',    # В режиме WAL безопасно и заметно быстрее FULL
+    'mmap_size': 268435456,     # 256 МБ файла базы читаются через mmap
+    'cache_size': -20000,       # Кэш страниц ~20 МБ на соединение
+    'busy_timeout': 5000,       # Ожидание блокировки в миллисекундах
+    'temp_store': 'MEMORY'      # Временные таблицы и индексы в памяти
+}
+SESSION_FLUSH_INTERVAL = 5      # Как часто (сек) сохранять измененные сессии пользователей в базу
+SESSION_FLUSH_BATCH_SIZE = 500  # Сохранять раньше, если накопилось столько измененных сессий
+SESSION_MAX_LIVE = 10000        # Максимум сессий в памяти, давние сверх лимита выгружаются (корзины остаются в базе)
+SESSION_IDLE_TTL = 3600         # Через сколько секунд бездействия сессия выгружается из памяти
+MAX_TRACKED_MESSAGES = 50       # Сколько id сообщений пользователя хранить для последующей очистки
+FSM_STORAGE = 'sqlite'          # Где хранить состояния диалогов: 'sqlite', 'redis' или 'memory'
+FSM_REDIS_URL = 'redis://localhost:6379/0'  # Адрес Redis-совместимого сервера для FSM_STORAGE = 'redis'
+FSM_FLUSH_INTERVAL = 1         # Как часто (сек) сохранять измененные состояния в SQLite
+FSM_CACHE_SIZE = 10000         # Сколько состояний держать в памяти
+WORKERS = 1                     # Количество процессов-обработчиков; при >1 основной процесс только получает апдейты и раздает их по user_id
+BOT_MODE = 'polling'            # Как получать апдейты: 'polling' (getUpdates) или 'webhook'
+WEBHOOK_URL = ''                # Публичный адрес бота (https://example.com); пусто - вебхук настроен вручную
+WEBHOOK_PATH = '/webhook'       # Путь, на который Telegram присылает апдейты
+WEBHOOK_SECRET = ''             # Секрет для проверки заголовка X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_HOST = '127.0.0.1'      # Адрес, на котором слушает веб-сервер (обычно за reverse proxy)
+WEBHOOK_PORT = 8080             # Порт веб-сервера
+OUTBOUND_GLOBAL_RATE = 30       # Сколько запросов в секунду бот отправляет в Telegram (делится между воркерами)
+OUTBOUND_CHAT_RATE = 1          # Запросов в секунду в один личный чат
+OUTBOUND_CHAT_BURST = 5         # Сколько запросов в личный чат можно отправить подряд без ожидания
+OUTBOUND_GROUP_RATE = 20 / 60   # Запросов в секунду в одну группу
+OUTBOUND_MAX_RETRIES = 3        # Сколько раз повторять запрос после ответа 429
+EDIT_COALESCE_WINDOW = 0.5      # Частые нажатия +/- в течение стольких секунд склеиваются в одну правку сообщения
+OUTBOX_POLL_INTERVAL = 5        # Как часто (сек) проверять очередь заказов на выгрузку в Google Таблицу
+OUTBOX_MAX_ATTEMPTS = 8         # После стольких неудачных попыток заказ помечается как невыгруженный
+OUTBOX_BACKOFF_BASE = 10        # Пауза (сек) перед первой повторной попыткой, дальше удваивается
+OUTBOX_BACKOFF_MAX = 3600       # Максимальная пауза (сек) между попытками
+OUTBOX_LEASE = 300              # Через сколько секунд заказ снова доступен, если процесс упал во время выгрузки
+OUTBOX_BATCH_WINDOW = 2         # Сколько секунд копить новые заказы, чтобы выгрузить их одним запросом
+OUTBOX_BATCH_SIZE = 50          # Максимум заказов в одном запросе к Google Таблице
+SHEETS_FORMAT_INTERVAL = 300    # Как часто (сек) форматировать новые строки и подбирать ширину столбцов
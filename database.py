@@ -1,316 +1,832 @@
 import sqlite3
-from typing import Dict, Optional, List, Union
+import queue
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, List, Tuple, Union
+
+from config import DB_PATH, DB_POOL_SIZE, DB_PRAGMAS
+from catalog_cache import catalog_cache
+from models import Category, Product
+
+def connect(database: str = DB_PATH, pragmas: Optional[Dict] = None) -> sqlite3.Connection:
+    """Открывает соединение с базой данных и применяет настройки SQLite"""
+    conn = sqlite3.connect(database, check_same_thread=False)
+    for name, value in (DB_PRAGMAS if pragmas is None else pragmas).items():
+        conn.execute(f'PRAGMA {name} = {value}')
+    return conn
+
+class ConnectionPool:
+    """Пул долгоживущих соединений с SQLite, общий для всех потоков"""
+
+    def __init__(self, database: str, size: int):
+        self.database = database
+        self.size = max(1, size)
+        self._connections = queue.Queue(maxsize=self.size)
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _create_connection(self) -> sqlite3.Connection:
+        return connect(self.database)
+
+    @contextmanager
+    def connection(self):
+        """Выдает соединение из пула и возвращает его обратно после использования"""
+        try:
+            conn = self._connections.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_create = self._created < self.size
+                if can_create:
+                    self._created += 1
+            if can_create:
+                try:
+                    conn = self._create_connection()
+                except sqlite3.Error:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                conn = self._connections.get()
+        try:
+            yield conn
+        finally:
+            # Незавершенная транзакция (например, после ошибки) не должна
+            # попасть к следующему пользователю соединения
+            if conn.in_transaction:
+                conn.rollback()
+            self._connections.put(conn)
+
+    def close(self):
+        """Закрывает все свободные соединения пула"""
+        while True:
+            try:
+                conn = self._connections.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+pool = ConnectionPool(DB_PATH, DB_POOL_SIZE)
 
 def create_tables():
     """Создает таблицы в базе данных"""
-    conn = sqlite3.connect('shop.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS categories (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        category_id TEXT UNIQUE NOT NULL,
-        name TEXT NOT NULL
-    )
-    ''')
-    
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS products (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        price INTEGER NOT NULL,
-        image_url TEXT,
-        category_id TEXT NOT NULL,
-        FOREIGN KEY (category_id) REFERENCES categories (category_id)
-    )
-    ''')
-    
-    conn.commit()
-    conn.close()
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS categories (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            category_id TEXT UNIQUE NOT NULL,
+            name TEXT NOT NULL
+        )
+        ''')
+
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS products (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            price INTEGER NOT NULL,
+            image_url TEXT,
+            category_id TEXT NOT NULL,
+            FOREIGN KEY (category_id) REFERENCES categories (category_id)
+        )
+        ''')
+
+        conn.commit()
+
+# Миграции схемы: (версия, SQL-команды). Номер последней примененной миграции
+# хранится в PRAGMA user_version, поэтому существующие базы обновляются на месте.
+# Новые миграции добавляются только в конец списка.
+MIGRATIONS = [
+    (1, [
+        # Товары категории с сортировкой по цене (каталог) и удаление категории
+        'CREATE INDEX IF NOT EXISTS idx_products_category_price ON products (category_id, price)'
+    ]),
+    (2, [
+        # Полнотекстовый индекс по названиям товаров для поиска
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+            name,
+            content='products',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        )''',
+        '''CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+            INSERT INTO products_fts (rowid, name) VALUES (new.id, new.name);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+            INSERT INTO products_fts (products_fts, rowid, name) VALUES ('delete', old.id, old.name);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF name ON products BEGIN
+            INSERT INTO products_fts (products_fts, rowid, name) VALUES ('delete', old.id, old.name);
+            INSERT INTO products_fts (rowid, name) VALUES (new.id, new.name);
+        END''',
+        "INSERT INTO products_fts (products_fts) VALUES ('rebuild')"
+    ]),
+    (3, [
+        # Сессии пользователей (корзина, телефон, адрес, id сообщений) в JSON
+        '''CREATE TABLE IF NOT EXISTS sessions (
+            user_id INTEGER PRIMARY KEY,
+            data TEXT NOT NULL,
+            updated_at INTEGER NOT NULL
+        )'''
+    ]),
+    (4, [
+        # Состояния и данные FSM (оформление заказа, админ-панель)
+        '''CREATE TABLE IF NOT EXISTS fsm_storage (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL
+        )'''
+    ]),
+    (5, [
+        # file_id фото товара в Telegram, сбрасывается при замене изображения
+        'ALTER TABLE products ADD COLUMN image_file_id TEXT'
+    ]),
+    (6, [
+        # Заказы, ожидающие выгрузки в Google Таблицу (pending -> sent или dead)
+        '''CREATE TABLE IF NOT EXISTS order_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at INTEGER NOT NULL,
+            last_error TEXT,
+            created_at INTEGER NOT NULL
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_order_outbox_status ON order_outbox (status, next_attempt_at)'
+    ]),
+]
+
+def apply_migrations():
+    """Применяет к базе данных миграции, которые еще не были применены"""
+    with pool.connection() as conn:
+        current_version = conn.execute('PRAGMA user_version').fetchone()[0]
+        for version, statements in MIGRATIONS:
+            if version <= current_version:
+                continue
+            try:
+                conn.execute('BEGIN')
+                for statement in statements:
+                    conn.execute(statement)
+                conn.execute(f'PRAGMA user_version = {version}')
+                conn.commit()
+                print(f"Применена миграция базы данных {version}")
+            except sqlite3.Error as e:
+                print(f"Ошибка при применении миграции {version}: {e}")
+                conn.rollback()
+                raise
 
 def add_category(category_id: str, name: str) -> bool:
     """Добавляет категорию в базу данных"""
-    conn = sqlite3.connect('shop.db')
-    cursor = conn.cursor()
-    try:
-        cursor.execute('INSERT INTO categories (category_id, name) VALUES (?, ?)', (category_id, name))
-        conn.commit()
-        return True
-    except sqlite3.IntegrityError:
-        # Категория уже существует
-        return False
-    except sqlite3.Error as e:
-        print(f"Ошибка при добавлении категории: {e}")
-        return False
-    finally:
-        conn.close()
-
-def add_product(name: str, price: int, image_url: Optional[str], category_id: str) -> bool:
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute('INSERT INTO categories (category_id, name) VALUES (?, ?)', (category_id, name))
+            conn.commit()
+            catalog_cache.invalidate()
+            return True
+        except sqlite3.IntegrityError:
+            # Категория уже существует
+            return False
+        except sqlite3.Error as e:
+            print(f"Ошибка при добавлении категории: {e}")
+            return False
+
+def add_product(
+    name: str,
+    price: int,
+    image_url: Optional[str],
+    category_id: str,
+    image_file_id: Optional[str] = None
+) -> bool:
     """Добавляет товар в базу данных"""
-    conn = sqlite3.connect('shop.db')
-    cursor = conn.cursor()
-    try:
-        cursor.execute(
-            'INSERT INTO products (name, price, image_url, category_id) VALUES (?, ?, ?, ?)',
-            (name, price, image_url, category_id)
-        )
-        conn.commit()
-        return True
-    except sqlite3.Error as e:
-        print(f"Ошибка при добавлении товара: {e}")
-        return False
-    finally:
-        conn.close()
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                'INSERT INTO products (name, price, image_url, category_id, image_file_id) VALUES (?, ?, ?, ?, ?)',
+                (name, price, image_url, category_id, image_file_id)
+            )
+            conn.commit()
+            catalog_cache.invalidate()
+            return True
+        except sqlite3.Error as e:
+            print(f"Ошибка при добавлении товара: {e}")
+            return False
 
 def get_categories() -> Dict[str, str]:
     """Возвращает словарь категорий {category_id: name}"""
-    conn = sqlite3.connect('shop.db')
-    cursor = conn.cursor()
-    try:
-        cursor.execute('SELECT category_id, name FROM categories')
-        return {row[0]: row[1] for row in cursor.fetchall()}
-    except sqlite3.Error as e:
-        print(f"Ошибка при получении категорий: {e}")
-        return {}
-    finally:
-        conn.close()
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute('SELECT category_id, name FROM categories')
+            return {row[0]: row[1] for row in cursor.fetchall()}
+        except sqlite3.Error as e:
+            print(f"Ошибка при получении категорий: {e}")
+            return {}
 
-def get_all_categories() -> List[Dict]:
+def get_all_categories() -> List[Category]:
     """Возвращает список всех категорий с полной информацией"""
-    conn = sqlite3.connect('shop.db')
-    cursor = conn.cursor()
-    try:
-        cursor.execute('SELECT id, category_id, name FROM categories')
-        return [
-            {'id': row[0], 'category_id': row[1], 'name': row[2]}
-            for row in cursor.fetchall()
-        ]
-    except sqlite3.Error as e:
-        print(f"Ошибка при получении категорий: {e}")
-        return []
-    finally:
-        conn.close()
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute('SELECT id, category_id, name FROM categories')
+            return [Category._make(row) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            print(f"Ошибка при получении категорий: {e}")
+            return []
+
+def get_categories_page(after_id: int = 0, limit: int = 5) -> List[Category]:
+    """Возвращает страницу категорий с id больше after_id (пагинация по ключу)"""
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                'SELECT id, category_id, name FROM categories WHERE id > ? ORDER BY id LIMIT ?',
+                (after_id, limit)
+            )
+            return [Category._make(row) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            print(f"Ошибка при получении категорий: {e}")
+            return []
+
+def count_categories() -> int:
+    """Возвращает количество категорий"""
+    with pool.connection() as conn:
+        try:
+            return conn.execute('SELECT COUNT(*) FROM categories').fetchone()[0]
+        except sqlite3.Error as e:
+            print(f"Ошибка при подсчете категорий: {e}")
+            return 0
 
-def get_products_by_category(category_id: str) -> Dict[int, Dict]:
+def get_products_by_category(category_id: str) -> List[Product]:
     """Возвращает товары в категории, отсортированные по цене (от дешевых к дорогим)"""
-    conn = sqlite3.connect('shop.db')
-    cursor = conn.cursor()
-    try:
-        cursor.execute(
-            'SELECT id, name, price, image_url FROM products WHERE category_id = ? ORDER BY price ASC',
-            (category_id,)
-        )
-        return {
-            row[0]: {
-                'name': row[1],
-                'price': row[2],
-                'image_url': row[3],
-                'category': category_id
-            }
-            for row in cursor.fetchall()
-        }
-    except sqlite3.Error as e:
-        print(f"Ошибка при получении товаров: {e}")
-        return {}
-    finally:
-        conn.close()
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                '''SELECT p.id, p.name, p.price, p.image_url, p.category_id, c.name as category_name, p.image_file_id
+                FROM products p
+                JOIN categories c ON p.category_id = c.category_id
+                WHERE p.category_id = ?
+                ORDER BY p.price ASC''',
+                (category_id,)
+            )
+            return [Product._make(row) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            print(f"Ошибка при получении товаров: {e}")
+            return []
 
-def get_all_products() -> List[Dict]:
+def get_all_products() -> List[Product]:
     """Возвращает список всех товаров с информацией о категориях"""
-    conn = sqlite3.connect('shop.db')
-    cursor = conn.cursor()
-    try:
-        cursor.execute('''
-            SELECT p.id, p.name, p.price, p.image_url, p.category_id, c.name as category_name
-            FROM products p
-            JOIN categories c ON p.category_id = c.category_id
-        ''')
-        return [
-            {
-                'id': row[0],
-                'name': row[1],
-                'price': row[2],
-                'image_url': row[3],
-                'category': row[4],
-                'category_name': row[5]
-            }
-            for row in cursor.fetchall()
-        ]
-    except sqlite3.Error as e:
-        print(f"Ошибка при получении товаров: {e}")
-        return []
-    finally:
-        conn.close()
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute('''
+                SELECT p.id, p.name, p.price, p.image_url, p.category_id, c.name as category_name, p.image_file_id
+                FROM products p
+                JOIN categories c ON p.category_id = c.category_id
+            ''')
+            return [Product._make(row) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            print(f"Ошибка при получении товаров: {e}")
+            return []
+
+def get_products_page(after_id: int = 0, limit: int = 5) -> List[Product]:
+    """Возвращает страницу товаров с id больше after_id (пагинация по ключу)"""
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                '''SELECT p.id, p.name, p.price, p.image_url, p.category_id, c.name as category_name, p.image_file_id
+                FROM products p
+                JOIN categories c ON p.category_id = c.category_id
+                WHERE p.id > ?
+                ORDER BY p.id
+                LIMIT ?''',
+                (after_id, limit)
+            )
+            return [Product._make(row) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            print(f"Ошибка при получении товаров: {e}")
+            return []
 
-def get_product(product_id: int) -> Optional[Dict]:
+def count_products() -> int:
+    """Возвращает количество товаров"""
+    with pool.connection() as conn:
+        try:
+            return conn.execute('SELECT COUNT(*) FROM products').fetchone()[0]
+        except sqlite3.Error as e:
+            print(f"Ошибка при подсчете товаров: {e}")
+            return 0
+
+def get_previous_page_cursor(table: str, first_id: int, limit: int) -> int:
+    """Возвращает after_id предыдущей страницы для страницы, начинающейся с first_id"""
+    if table not in ('categories', 'products'):
+        raise ValueError(f"Неизвестная таблица: {table}")
+    with pool.connection() as conn:
+        try:
+            # Пропускаем записи предыдущей страницы, нужен id записи перед ней
+            row = conn.execute(
+                f'SELECT id FROM {table} WHERE id < ? ORDER BY id DESC LIMIT 1 OFFSET ?',
+                (first_id, limit)
+            ).fetchone()
+            return row[0] if row else 0
+        except sqlite3.Error as e:
+            print(f"Ошибка при получении страницы: {e}")
+            return 0
+
+def get_product(product_id: int) -> Optional[Product]:
     """Возвращает информацию о товаре"""
-    conn = sqlite3.connect('shop.db')
-    cursor = conn.cursor()
-    try:
-        cursor.execute(
-            '''SELECT p.id, p.name, p.price, p.image_url, p.category_id, c.name as category_name
-            FROM products p
-            JOIN categories c ON p.category_id = c.category_id
-            WHERE p.id = ?''',
-            (product_id,)
-        )
-        row = cursor.fetchone()
-        if row:
-            return {
-                'id': row[0],
-                'name': row[1],
-                'price': row[2],
-                'image_url': row[3],
-                'category': row[4],
-                'category_name': row[5]
-            }
-        return None
-    except sqlite3.Error as e:
-        print(f"Ошибка при получении товара: {e}")
-        return None
-    finally:
-        conn.close()
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                '''SELECT p.id, p.name, p.price, p.image_url, p.category_id, c.name as category_name, p.image_file_id
+                FROM products p
+                JOIN categories c ON p.category_id = c.category_id
+                WHERE p.id = ?''',
+                (product_id,)
+            )
+            row = cursor.fetchone()
+            return Product._make(row) if row else None
+        except sqlite3.Error as e:
+            print(f"Ошибка при получении товара: {e}")
+            return None
+
+def get_products(product_ids) -> Dict[int, Product]:
+    """Возвращает словарь {product_id: товар} для нескольких товаров одним запросом"""
+    product_ids = list(dict.fromkeys(product_ids))
+    if not product_ids:
+        return {}
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            products = {}
+            # Ограничиваем число параметров в одном запросе
+            for start in range(0, len(product_ids), 500):
+                chunk = product_ids[start:start + 500]
+                placeholders = ', '.join('?' * len(chunk))
+                cursor.execute(
+                    f'''SELECT p.id, p.name, p.price, p.image_url, p.category_id, c.name as category_name, p.image_file_id
+                    FROM products p
+                    JOIN categories c ON p.category_id = c.category_id
+                    WHERE p.id IN ({placeholders})''',
+                    chunk
+                )
+                for row in cursor.fetchall():
+                    products[row[0]] = Product._make(row)
+            return products
+        except sqlite3.Error as e:
+            print(f"Ошибка при получении товаров: {e}")
+            return {}
+
+def _fts_query(text: str) -> str:
+    """Превращает пользовательский ввод в запрос FTS5 с поиском по началу слов"""
+    words = re.findall(r'\w+', text.lower())
+    return ' '.join(f'"{word}"*' for word in words)
+
+def search_products(text: str, limit: int = 20) -> List[Product]:
+    """Ищет товары по названию (все слова запроса, по началу слова)"""
+    query = _fts_query(text)
+    if not query:
+        return []
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                '''SELECT p.id, p.name, p.price, p.image_url, p.category_id, c.name as category_name, p.image_file_id
+                FROM products_fts f
+                JOIN products p ON p.id = f.rowid
+                JOIN categories c ON p.category_id = c.category_id
+                WHERE products_fts MATCH ?
+                ORDER BY f.rank
+                LIMIT ?''',
+                (query, limit)
+            )
+            return [Product._make(row) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            print(f"Ошибка при поиске товаров: {e}")
+            return []
 
 def update_category(category_id: str, new_name: str) -> bool:
     """Обновляет название категории"""
-    conn = sqlite3.connect('shop.db')
-    cursor = conn.cursor()
-    try:
-        cursor.execute(
-            'UPDATE categories SET name = ? WHERE category_id = ?',
-            (new_name, category_id)
-        )
-        conn.commit()
-        return cursor.rowcount > 0
-    except sqlite3.Error as e:
-        print(f"Ошибка при обновлении категории: {e}")
-        return False
-    finally:
-        conn.close()
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                'UPDATE categories SET name = ? WHERE category_id = ?',
+                (new_name, category_id)
+            )
+            conn.commit()
+            catalog_cache.invalidate()
+            return cursor.rowcount > 0
+        except sqlite3.Error as e:
+            print(f"Ошибка при обновлении категории: {e}")
+            return False
 
 def delete_category(category_id: str) -> bool:
     """Удаляет категорию (и все связанные товары)"""
-    conn = sqlite3.connect('shop.db')
-    cursor = conn.cursor()
-    try:
-        cursor.execute('DELETE FROM products WHERE category_id = ?', (category_id,))
-        cursor.execute('DELETE FROM categories WHERE category_id = ?', (category_id,))
-        conn.commit()
-        return True
-    except sqlite3.Error as e:
-        print(f"Ошибка при удалении категории: {e}")
-        conn.rollback()
-        return False
-    finally:
-        conn.close()
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute('DELETE FROM products WHERE category_id = ?', (category_id,))
+            cursor.execute('DELETE FROM categories WHERE category_id = ?', (category_id,))
+            conn.commit()
+            catalog_cache.invalidate()
+            return True
+        except sqlite3.Error as e:
+            print(f"Ошибка при удалении категории: {e}")
+            conn.rollback()
+            return False
 
 def delete_product(product_id: int) -> bool:
     """Удаляет товар"""
-    conn = sqlite3.connect('shop.db')
-    cursor = conn.cursor()
-    try:
-        cursor.execute('DELETE FROM products WHERE id = ?', (product_id,))
-        conn.commit()
-        return cursor.rowcount > 0
-    except sqlite3.Error as e:
-        print(f"Ошибка при удалении товара: {e}")
-        return False
-    finally:
-        conn.close()
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute('DELETE FROM products WHERE id = ?', (product_id,))
+            conn.commit()
+            catalog_cache.invalidate()
+            return cursor.rowcount > 0
+        except sqlite3.Error as e:
+            print(f"Ошибка при удалении товара: {e}")
+            return False
 
-def initialize_database():
-    """Инициализирует базу данных с тестовыми данными"""
-    print("Инициализация базы данных...")
-    create_tables()
-    
-    conn = sqlite3.connect('shop.db')
-    cursor = conn.cursor()
-    try:
-        cursor.execute('SELECT COUNT(*) FROM categories')
-        if cursor.fetchone()[0] == 0:
-            print("Добавление тестовых данных...")
-            
-            categories = [
-                ("STICKS", "Стики"),
-                ("BEER", "Пиво"),
-                ("CIGARETTES", "Сигареты"),
-                ("WINE", "Вино"),
-                ("WHISKEY", "Виски"),
-                ("VODKA", "Водка"),
-                ("COGNAC", "Коньяк"),
-                ("CHAMPAGNE", "Игристое и шампанское"),
-                ("SNACKS", "Снеки"),
-                ("HQD", "Hqd")
-            ]
-            
+def import_catalog_batch(categories: Dict[str, Optional[str]], products: List[Dict]) -> bool:
+    """Добавляет или обновляет пачку категорий и товаров одной транзакцией.
+
+    categories - {category_id: name}; если name не указано, существующая
+    категория не меняется, а новая получает название, равное category_id.
+    Товар с id обновляется по id, товар без id - по паре (category_id, name).
+    """
+    named_categories = [(category_id, name) for category_id, name in categories.items() if name]
+    unnamed_categories = [(category_id, category_id) for category_id, name in categories.items() if not name]
+
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        try:
             cursor.executemany(
-                'INSERT OR IGNORE INTO categories (category_id, name) VALUES (?, ?)',
-                categories
+                '''INSERT INTO categories (category_id, name) VALUES (?, ?)
+                ON CONFLICT(category_id) DO UPDATE SET name = excluded.name''',
+                named_categories
             )
-            
-            products = [
-                ("Fiit Viola", 270, "Fiit_Viola.jpg", "STICKS"),
-                ("Corona Extra 0,35 л", 195, "Corona_extra.jpg", "BEER"),
-                ("Parliament Aqua Blue", 435, "Parliament.jpg", "CIGARETTES"),
-                ("Duffour Gascogne красное сухое 0,75 л.", 1500, "Duffour.jpg", "WINE"),
-                ("Jameson 0,7 л", 2300, "Jameson.jpg", "WHISKEY"),
-                ("Beluga Transatlantic 0,7 л", 2200, "Beluga.jpg", "VODKA"),
-                ("Ной Традиционный 5 лет 0,5 л", 1300, "Noi.jpg", "COGNAC"),
-                ("игристое Martini Prosecco белое сухое 0,75 л", 1550, "Martini.jpg", "CHAMPAGNE"),
-                ("Картофельные чипсы Lay's Сметана и лук 140 г", 230, "Lays.jpg", "SNACKS"),
-                ("HQD NEO PRO 18000 Triple Berry (Тройная Ягода)", 1620, "HQD.jpg", "HQD")
-            ]
-            
             cursor.executemany(
-                'INSERT INTO products (name, price, image_url, category_id) VALUES (?, ?, ?, ?)',
-                products
+                'INSERT OR IGNORE INTO categories (category_id, name) VALUES (?, ?)',
+                unnamed_categories
+            )
+            # Строки применяются в порядке файла, поэтому при повторах одного
+            # товара (по id или по категории и названию) побеждает последняя
+            for p in products:
+                if p.get('id') is not None:
+                    cursor.execute(
+                        '''INSERT INTO products (id, name, price, image_url, category_id) VALUES (?, ?, ?, ?, ?)
+                        ON CONFLICT(id) DO UPDATE SET
+                            name = excluded.name,
+                            price = excluded.price,
+                            image_url = COALESCE(excluded.image_url, products.image_url),
+                            image_file_id = CASE
+                                WHEN COALESCE(excluded.image_url, products.image_url) IS products.image_url
+                                THEN products.image_file_id
+                            END,
+                            category_id = excluded.category_id''',
+                        (p['id'], p['name'], p['price'], p.get('image_url'), p['category_id'])
+                    )
+                    continue
+                cursor.execute(
+                    '''UPDATE products SET
+                        price = ?1,
+                        image_url = COALESCE(?2, image_url),
+                        image_file_id = CASE WHEN COALESCE(?2, image_url) IS image_url THEN image_file_id END
+                    WHERE category_id = ?3 AND name = ?4''',
+                    (p['price'], p.get('image_url'), p['category_id'], p['name'])
+                )
+                if cursor.rowcount == 0:
+                    cursor.execute(
+                        'INSERT INTO products (name, price, image_url, category_id) VALUES (?, ?, ?, ?)',
+                        (p['name'], p['price'], p.get('image_url'), p['category_id'])
+                    )
+            conn.commit()
+            catalog_cache.invalidate()
+            return True
+        except sqlite3.Error as e:
+            print(f"Ошибка при импорте каталога: {e}")
+            conn.rollback()
+            return False
+
+def load_session(user_id: int) -> Optional[str]:
+    """Возвращает сохраненную сессию пользователя в виде JSON"""
+    with pool.connection() as conn:
+        try:
+            row = conn.execute('SELECT data FROM sessions WHERE user_id = ?', (user_id,)).fetchone()
+            return row[0] if row else None
+        except sqlite3.Error as e:
+            print(f"Ошибка при загрузке сессии: {e}")
+            return None
+
+def save_sessions(sessions: List[Tuple[int, str]]) -> bool:
+    """Сохраняет пачку сессий [(user_id, JSON)] одной транзакцией"""
+    if not sessions:
+        return True
+    updated_at = int(time.time())
+    with pool.connection() as conn:
+        try:
+            conn.executemany(
+                '''INSERT INTO sessions (user_id, data, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at''',
+                [(user_id, data, updated_at) for user_id, data in sessions]
             )
-            
             conn.commit()
-            print("Тестовые данные успешно добавлены")
-        else:
-            print("База данных уже содержит данные, пропускаем инициализацию")
-    except sqlite3.Error as e:
-        print(f"Ошибка при инициализации базы данных: {e}")
-        conn.rollback()
-    finally:
-        conn.close()
+            return True
+        except sqlite3.Error as e:
+            print(f"Ошибка при сохранении сессий: {e}")
+            conn.rollback()
+            return False
+
+def load_fsm_record(key: str) -> Optional[Tuple[Optional[str], str]]:
+    """Возвращает (state, data JSON) записи FSM по ключу"""
+    with pool.connection() as conn:
+        try:
+            return conn.execute('SELECT state, data FROM fsm_storage WHERE key = ?', (key,)).fetchone()
+        except sqlite3.Error as e:
+            print(f"Ошибка при загрузке состояния: {e}")
+            return None
+
+def save_fsm_records(records: List[Tuple[str, Optional[str], str]], deleted_keys: List[str]) -> bool:
+    """Сохраняет записи FSM [(key, state, data JSON)] и удаляет пустые одной транзакцией"""
+    if not records and not deleted_keys:
+        return True
+    with pool.connection() as conn:
+        try:
+            conn.executemany(
+                '''INSERT INTO fsm_storage (key, state, data) VALUES (?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data''',
+                records
+            )
+            conn.executemany('DELETE FROM fsm_storage WHERE key = ?', [(key,) for key in deleted_keys])
+            conn.commit()
+            return True
+        except sqlite3.Error as e:
+            print(f"Ошибка при сохранении состояний: {e}")
+            conn.rollback()
+            return False
+
+def enqueue_order(user_id: int, payload: str) -> Optional[int]:
+    """Сохраняет заказ в очередь на выгрузку и возвращает его номер"""
+    now = int(time.time())
+    with pool.connection() as conn:
+        try:
+            cursor = conn.execute(
+                '''INSERT INTO order_outbox (user_id, payload, next_attempt_at, created_at)
+                VALUES (?, ?, ?, ?)''',
+                (user_id, payload, now, now)
+            )
+            conn.commit()
+            return cursor.lastrowid
+        except sqlite3.Error as e:
+            print(f"Ошибка при сохранении заказа: {e}")
+            conn.rollback()
+            return None
+
+def claim_due_orders(limit: int, lease: int) -> List[Tuple[int, str, int]]:
+    """Забирает заказы, которые пора выгрузить: [(id, payload, attempts)].
+
+    Заказы откладываются на lease секунд одним запросом, поэтому несколько
+    процессов не возьмут один заказ, а заказ процесса, упавшего во время
+    выгрузки, снова станет доступен по истечении lease.
+    """
+    now = int(time.time())
+    with pool.connection() as conn:
+        try:
+            cursor = conn.execute(
+                '''UPDATE order_outbox SET next_attempt_at = ?
+                WHERE id IN (
+                    SELECT id FROM order_outbox
+                    WHERE status = 'pending' AND next_attempt_at <= ?
+                    ORDER BY id
+                    LIMIT ?
+                )
+                RETURNING id, payload, attempts''',
+                (now + lease, now, limit)
+            )
+            rows = cursor.fetchall()
+            conn.commit()
+            return sorted(rows)
+        except sqlite3.Error as e:
+            print(f"Ошибка при получении заказов для выгрузки: {e}")
+            conn.rollback()
+            return []
+
+def mark_orders_sent(order_ids: List[int]) -> bool:
+    """Отмечает заказы как выгруженные"""
+    with pool.connection() as conn:
+        try:
+            conn.executemany(
+                "UPDATE order_outbox SET status = 'sent', last_error = NULL WHERE id = ?",
+                [(order_id,) for order_id in order_ids]
+            )
+            conn.commit()
+            return True
+        except sqlite3.Error as e:
+            print(f"Ошибка при обновлении заказов: {e}")
+            conn.rollback()
+            return False
+
+def mark_order_failed(order_id: int, error: str, next_attempt_at: Optional[int]) -> bool:
+    """Записывает неудачную попытку; без next_attempt_at заказ больше не повторяется (dead)"""
+    with pool.connection() as conn:
+        try:
+            conn.execute(
+                '''UPDATE order_outbox SET
+                    attempts = attempts + 1,
+                    last_error = ?1,
+                    status = CASE WHEN ?2 IS NULL THEN 'dead' ELSE 'pending' END,
+                    next_attempt_at = COALESCE(?2, next_attempt_at)
+                WHERE id = ?3''',
+                (error, next_attempt_at, order_id)
+            )
+            conn.commit()
+            return True
+        except sqlite3.Error as e:
+            print(f"Ошибка при обновлении заказа: {e}")
+            conn.rollback()
+            return False
+
+def count_outbox_orders() -> Dict[str, int]:
+    """Количество заказов в очереди выгрузки по статусам"""
+    with pool.connection() as conn:
+        try:
+            rows = conn.execute('SELECT status, COUNT(*) FROM order_outbox GROUP BY status').fetchall()
+            return dict(rows)
+        except sqlite3.Error as e:
+            print(f"Ошибка при подсчете заказов: {e}")
+            return {}
+
+def get_dead_orders(limit: int = 10) -> List[Tuple[int, int, int, Optional[str], int]]:
+    """Заказы, которые не удалось выгрузить: [(id, user_id, attempts, last_error, created_at)]"""
+    with pool.connection() as conn:
+        try:
+            return conn.execute(
+                '''SELECT id, user_id, attempts, last_error, created_at FROM order_outbox
+                WHERE status = 'dead'
+                ORDER BY id DESC
+                LIMIT ?''',
+                (limit,)
+            ).fetchall()
+        except sqlite3.Error as e:
+            print(f"Ошибка при получении заказов: {e}")
+            return []
+
+def retry_dead_orders() -> int:
+    """Возвращает невыгруженные заказы в очередь и возвращает их количество"""
+    with pool.connection() as conn:
+        try:
+            cursor = conn.execute(
+                "UPDATE order_outbox SET status = 'pending', attempts = 0, next_attempt_at = ? WHERE status = 'dead'",
+                (int(time.time()),)
+            )
+            conn.commit()
+            return cursor.rowcount
+        except sqlite3.Error as e:
+            print(f"Ошибка при повторной выгрузке заказов: {e}")
+            conn.rollback()
+            return 0
+
+def initialize_database():
+    """Инициализирует базу данных с тестовыми данными"""
+    print("Инициализация базы данных...")
+    create_tables()
+    apply_migrations()
+
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute('SELECT COUNT(*) FROM categories')
+            if cursor.fetchone()[0] == 0:
+                print("Добавление тестовых данных...")
+
+                categories = [
+                    ("STICKS", "Стики"),
+                    ("BEER", "Пиво"),
+                    ("CIGARETTES", "Сигареты"),
+                    ("WINE", "Вино"),
+                    ("WHISKEY", "Виски"),
+                    ("VODKA", "Водка"),
+                    ("COGNAC", "Коньяк"),
+                    ("CHAMPAGNE", "Игристое и шампанское"),
+                    ("SNACKS", "Снеки"),
+                    ("HQD", "Hqd")
+                ]
+
+                cursor.executemany(
+                    'INSERT OR IGNORE INTO categories (category_id, name) VALUES (?, ?)',
+                    categories
+                )
+
+                products = [
+                    ("Fiit Viola", 270, "Fiit_Viola.jpg", "STICKS"),
+                    ("Corona Extra 0,35 л", 195, "Corona_extra.jpg", "BEER"),
+                    ("Parliament Aqua Blue", 435, "Parliament.jpg", "CIGARETTES"),
+                    ("Duffour Gascogne красное сухое 0,75 л.", 1500, "Duffour.jpg", "WINE"),
+                    ("Jameson 0,7 л", 2300, "Jameson.jpg", "WHISKEY"),
+                    ("Beluga Transatlantic 0,7 л", 2200, "Beluga.jpg", "VODKA"),
+                    ("Ной Традиционный 5 лет 0,5 л", 1300, "Noi.jpg", "COGNAC"),
+                    ("игристое Martini Prosecco белое сухое 0,75 л", 1550, "Martini.jpg", "CHAMPAGNE"),
+                    ("Картофельные чипсы Lay's Сметана и лук 140 г", 230, "Lays.jpg", "SNACKS"),
+                    ("HQD NEO PRO 18000 Triple Berry (Тройная Ягода)", 1620, "HQD.jpg", "HQD")
+                ]
+
+                cursor.executemany(
+                    'INSERT INTO products (name, price, image_url, category_id) VALUES (?, ?, ?, ?)',
+                    products
+                )
+
+                conn.commit()
+                catalog_cache.invalidate()
+                print("Тестовые данные успешно добавлены")
+            else:
+                print("База данных уже содержит данные, пропускаем инициализацию")
+        except sqlite3.Error as e:
+            print(f"Ошибка при инициализации базы данных: {e}")
+            conn.rollback()
 
 def update_product(
     product_id: int,
     name: Optional[str] = None,
     price: Optional[int] = None,
     image_url: Optional[str] = None,
-    category_id: Optional[str] = None
-) -> bool:
-    """Обновляет информацию о товаре"""
-    conn = sqlite3.connect('shop.db')
-    cursor = conn.cursor()
-    try:
-        # Получаем текущие данные товара
-        current_data = get_product(product_id)
-        if not current_data:
-            return False
+    category_id: Optional[str] = None,
+    image_file_id: Optional[str] = None
+) -> Optional[Product]:
+    """Обновляет переданные поля товара одним запросом и возвращает товар после изменения.
 
-        # Подготавливаем новые значения
-        new_name = name if name is not None else current_data['name']
-        new_price = price if price is not None else current_data['price']
-        new_image_url = image_url if image_url is not None else current_data['image_url']
-        new_category_id = category_id if category_id is not None else current_data['category']
-
-        cursor.execute(
-            '''UPDATE products 
-            SET name = ?, price = ?, image_url = ?, category_id = ?
-            WHERE id = ?''',
-            (new_name, new_price, new_image_url, new_category_id, product_id)
+    При замене изображения сохраненный file_id сбрасывается (или заменяется
+    на image_file_id, если фото уже загружено в Telegram).
+    """
+    changes = {
+        column: value
+        for column, value in (
+            ('name', name),
+            ('price', price),
+            ('image_url', image_url),
+            ('category_id', category_id)
         )
-        conn.commit()
-        return cursor.rowcount > 0
-    except sqlite3.Error as e:
-        print(f"Ошибка при обновлении товара: {e}")
-        return False
-    finally:
-        conn.close()
+        if value is not None
+    }
+    if image_url is not None:
+        changes['image_file_id'] = image_file_id
+    if not changes:
+        return get_product(product_id)
+
+    assignments = ', '.join(f'{column} = ?' for column in changes)
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                f'''UPDATE products
+                SET {assignments}
+                WHERE id = ?
+                RETURNING id, name, price, image_url, category_id,
+                    (SELECT c.name FROM categories c WHERE c.category_id = products.category_id),
+                    image_file_id''',
+                (*changes.values(), product_id)
+            )
+            rows = cursor.fetchall()
+            conn.commit()
+            if not rows:
+                return None
+            product = Product._make(rows[0])
+            catalog_cache.patch_product(product)
+            return product
+        except sqlite3.Error as e:
+            print(f"Ошибка при обновлении товара: {e}")
+            return None
+
+def set_product_file_id(product_id: int, image_url: str, file_id: str) -> bool:
+    """Сохраняет file_id фото товара, если изображение за это время не заменили"""
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                'UPDATE products SET image_file_id = ? WHERE id = ? AND image_url = ?',
+                (file_id, product_id, image_url)
+            )
+            conn.commit()
+            if cursor.rowcount:
+                catalog_cache.set_file_id(product_id, image_url, file_id)
+            return cursor.rowcount > 0
+        except sqlite3.Error as e:
+            print(f"Ошибка при сохранении file_id товара: {e}")
+            return False
+
+def close_database():
+    """Закрывает соединения пула"""
+    pool.close()
 
 if __name__ == "__main__":
     initialize_database()
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from outbound import background_requests
+
+logger = logging.getLogger(__name__)
+
+class EditCoalescer:
+    """Склеивает частые правки одного сообщения.
+
+    Первая правка выполняется сразу, а все запрошенные в течение следующих
+    window секунд заменяют друг друга, и в конце окна выполняется только
+    последняя. Функция отрисовки читает состояние в момент выполнения,
+    поэтому в сообщении всегда оказывается актуальное количество товара.
+    Отложенные правки отправляются как фоновые запросы и не занимают
+    лимит чата, нужный для ответов пользователю.
+
+    Когда в сообщении показывают другой экран, ожидающую правку нужно
+    отменить (cancel), иначе она отрисует старый экран поверх нового.
+    """
+
+    def __init__(self, window: float = 0.5):
+        self.window = window
+        # (chat_id, message_id) -> функция, которая отредактирует сообщение
+        self._pending: Dict[Tuple[int, int], Callable[[], Awaitable]] = {}
+        self._tasks: Dict[Tuple[int, int], asyncio.Task] = {}
+        # Удерживается, пока выполняется правка сообщения
+        self._locks: Dict[Tuple[int, int], asyncio.Lock] = {}
+        self.requested = 0
+        self.performed = 0
+        self.cancelled = 0
+
+    def schedule(self, chat_id: int, message_id: int, render: Callable[[], Awaitable]):
+        """Запрашивает правку сообщения, не дожидаясь ее выполнения"""
+        key = (chat_id, message_id)
+        self.requested += 1
+        self._pending[key] = render
+        if key not in self._tasks:
+            self._locks[key] = asyncio.Lock()
+            self._tasks[key] = asyncio.create_task(self._run(key))
+
+    async def cancel(self, chat_id: int, message_id: int):
+        """Отменяет ожидающую правку сообщения.
+
+        Если правка уже выполняется, дожидается ее, чтобы новый экран
+        гарантированно был показан после нее.
+        """
+        key = (chat_id, message_id)
+        if self._pending.pop(key, None) is not None:
+            self.cancelled += 1
+        lock = self._locks.get(key)
+        if lock is not None:
+            async with lock:
+                pass
+
+    async def _run(self, key: Tuple[int, int]):
+        try:
+            while key in self._pending:
+                render = self._pending.pop(key)
+                self.performed += 1
+                async with self._locks[key]:
+                    try:
+                        await render()
+                    except Exception as e:
+                        logger.error(f"Ошибка при обновлении сообщения: {e}")
+                await asyncio.sleep(self.window)
+                # Следующие правки этой задачи - отложенные
+                background_requests.set(True)
+        finally:
+            del self._tasks[key]
+            del self._locks[key]
+
+    async def close(self):
+        """Дожидается отложенных правок"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'requested': self.requested,
+            'performed': self.performed,
+            'saved': self.requested - self.performed - self.cancelled - len(self._pending),
+            'cancelled': self.cancelled,
+            'pending': len(self._pending)
+        }
+
+class RenderedMessages:
+    """Последние отправленные текст и клавиатура сообщений.
+
+    Позволяет понять, что при правке изменились только кнопки (тогда
+    хватает editMessageReplyMarkup), или что не изменилось ничего
+    (тогда запрос не нужен вовсе). Хранится не больше max_messages записей.
+    """
+
+    def __init__(self, max_messages: int = 10000):
+        self.max_messages = max_messages
+        self._messages: "OrderedDict[Tuple[int, int], Tuple[str, Any]]" = OrderedDict()
+        self.full_edits = 0
+        self.markup_edits = 0
+        self.skipped = 0
+
+    def get(self, chat_id: int, message_id: int) -> Optional[Tuple[str, Any]]:
+        return self._messages.get((chat_id, message_id))
+
+    def forget(self, chat_id: int, message_id: int):
+        """Забывает сообщение, в котором показали другой экран"""
+        self._messages.pop((chat_id, message_id), None)
+
+    def remember(self, chat_id: int, message_id: int, text: str, reply_markup):
+        key = (chat_id, message_id)
+        self._messages[key] = (text, reply_markup)
+        self._messages.move_to_end(key)
+        if len(self._messages) > self.max_messages:
+            self._messages.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'messages': len(self._messages),
+            'full_edits': self.full_edits,
+            'markup_edits': self.markup_edits,
+            'skipped': self.skipped
+        }
@@ -0,0 +1,155 @@
+import asyncio
+import json
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, List, Mapping, Optional, Set
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import metrics
+from async_database import load_fsm_record, save_fsm_records
+from config import FSM_STORAGE, FSM_REDIS_URL, FSM_FLUSH_INTERVAL, FSM_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+class SQLiteStorage(BaseStorage):
+    """Хранилище FSM в SQLite с кэшем часто используемых ключей.
+
+    Состояния читаются из базы один раз и дальше берутся из кэша, а изменения
+    записываются в базу пачками раз в flush_interval секунд. В кэше держится
+    не больше cache_size ключей; выгружаются только уже сохраненные.
+    """
+
+    def __init__(self, flush_interval: float = 1.0, cache_size: int = 10000):
+        self.flush_interval = flush_interval
+        self.cache_size = cache_size
+        self.key_builder = DefaultKeyBuilder(
+            with_bot_id=True,
+            with_business_connection_id=True,
+            with_destiny=True
+        )
+        # key -> (state, data), порядок - от давно использованных к недавним
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self._dirty: Set[str] = set()
+        self._flush_task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+
+    async def _get_record(self, key: StorageKey) -> tuple:
+        storage_key = self.key_builder.build(key)
+        record = self._cache.get(storage_key)
+        if record is not None:
+            self.hits += 1
+            self._cache.move_to_end(storage_key)
+            return record
+        self.misses += 1
+        row = await load_fsm_record(storage_key)
+        # Пока шел запрос, запись могла измениться
+        record = self._cache.get(storage_key)
+        if record is None:
+            record = (row[0], json.loads(row[1])) if row else (None, {})
+            self._put(storage_key, record)
+        return record
+
+    def _put(self, storage_key: str, record: tuple):
+        self._cache[storage_key] = record
+        self._cache.move_to_end(storage_key)
+        if len(self._cache) > self.cache_size:
+            for old_key in list(self._cache):
+                if len(self._cache) <= self.cache_size:
+                    break
+                if old_key not in self._dirty:
+                    del self._cache[old_key]
+
+    async def _update_record(self, key: StorageKey, state: Optional[str], data: Dict[str, Any]):
+        storage_key = self.key_builder.build(key)
+        self._put(storage_key, (state, data))
+        self._dirty.add(storage_key)
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        _, data = await self._get_record(key)
+        await self._update_record(key, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._get_record(key)
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        state, _ = await self._get_record(key)
+        await self._update_record(key, state, dict(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._get_record(key)
+        return dict(data)
+
+    async def flush(self):
+        """Записывает в базу все измененные ключи одной пачкой"""
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        records: List[tuple] = []
+        deleted_keys: List[str] = []
+        for storage_key in dirty:
+            if storage_key not in self._cache:
+                continue
+            state, data = self._cache[storage_key]
+            if state is None and not data:
+                deleted_keys.append(storage_key)
+            else:
+                records.append((storage_key, state, json.dumps(data, ensure_ascii=False)))
+        if await save_fsm_records(records, deleted_keys):
+            self.flushes += 1
+        else:
+            self._dirty.update(dirty)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка при сохранении состояний FSM: {e}")
+
+    async def close(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'keys': len(self._cache),
+            'dirty': len(self._dirty),
+            'hits': self.hits,
+            'misses': self.misses,
+            'flushes': self.flushes
+        }
+
+def create_fsm_storage() -> BaseStorage:
+    """Создает хранилище FSM, выбранное в config.FSM_STORAGE"""
+    if FSM_STORAGE == 'sqlite':
+        storage = SQLiteStorage(FSM_FLUSH_INTERVAL, FSM_CACHE_SIZE)
+        metrics.register("Хранилище FSM", storage.stats)
+        return storage
+    if FSM_STORAGE == 'redis':
+        # Подойдет любой сервер с протоколом Redis
+        try:
+            from aiogram.fsm.storage.redis import RedisStorage
+        except ImportError:
+            raise ValueError(
+                "FSM_STORAGE = 'redis' требует пакет redis: pip install redis "
+                "(или выберите 'sqlite' или 'memory')"
+            ) from None
+        return RedisStorage.from_url(FSM_REDIS_URL)
+    if FSM_STORAGE == 'memory':
+        return MemoryStorage()
+    raise ValueError(f"Неизвестное хранилище FSM: {FSM_STORAGE}")
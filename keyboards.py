@@ -0,0 +1,94 @@
+from typing import Dict, Optional, Tuple
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+import metrics
+from async_database import get_categories, get_products_by_category
+from catalog_cache import catalog_cache
+
+class KeyboardCache:
+    """Готовые клавиатуры меню каталога.
+
+    Клавиатура категорий и клавиатуры товаров категорий строятся один раз
+    для текущей версии каталога и дальше отдаются без обращения к базе.
+    Когда админ-панель меняет каталог, версия catalog_cache увеличивается
+    и клавиатуры строятся заново при следующем показе.
+    """
+
+    def __init__(self):
+        self._version = None
+        self._categories: Optional[InlineKeyboardMarkup] = None
+        # category_id -> (название категории, клавиатура) или None, если товаров нет
+        self._category_products: Dict[str, Optional[Tuple[str, InlineKeyboardMarkup]]] = {}
+        self.hits = 0
+        self.builds = 0
+
+    def _check_version(self) -> int:
+        version = catalog_cache.current_version()
+        if version != self._version:
+            self._version = version
+            self._categories = None
+            self._category_products.clear()
+        return version
+
+    async def categories(self) -> InlineKeyboardMarkup:
+        """Клавиатура со списком категорий"""
+        version = self._check_version()
+        if self._categories is not None:
+            self.hits += 1
+            return self._categories
+
+        categories = await get_categories()
+        builder = InlineKeyboardBuilder()
+        for category_id, category_name in categories.items():
+            builder.add(InlineKeyboardButton(
+                text=category_name,
+                callback_data=f"category_{category_id}"
+            ))
+        builder.adjust(2)
+        keyboard = builder.as_markup()
+        self.builds += 1
+        # Пока строили, каталог могли изменить - тогда не сохраняем
+        if self._check_version() == version:
+            self._categories = keyboard
+        return keyboard
+
+    async def category_products(self, category_id: str) -> Optional[Tuple[str, InlineKeyboardMarkup]]:
+        """Название категории и клавиатура ее товаров; None, если товаров нет"""
+        version = self._check_version()
+        if category_id in self._category_products:
+            self.hits += 1
+            return self._category_products[category_id]
+
+        categories = await get_categories()
+        category_products = await get_products_by_category(category_id)
+        entry = None
+        if category_products:
+            builder = InlineKeyboardBuilder()
+            for product in category_products:
+                builder.add(InlineKeyboardButton(
+                    text=f"{product.price}₽ - {product.name}",
+                    callback_data=f"product_{product.id}"
+                ))
+            builder.adjust(1)
+            builder.row(InlineKeyboardButton(
+                text="Назад к категориям",
+                callback_data="back_to_categories"
+            ))
+            entry = (categories.get(category_id, "Неизвестная категория"), builder.as_markup())
+        self.builds += 1
+        # Несуществующие категории из callback_data не запоминаем
+        if self._check_version() == version and category_id in categories:
+            self._category_products[category_id] = entry
+        return entry
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'builds': self.builds,
+            'category_keyboards': len(self._category_products)
+        }
+
+keyboard_cache = KeyboardCache()
+metrics.register("Клавиатуры каталога", keyboard_cache.stats)
@@ -1,23 +1,61 @@
-from config import BOT_TOKEN, IMAGE_FOLDER
+from config import (
+    BOT_TOKEN,
+    SESSION_FLUSH_INTERVAL,
+    SESSION_FLUSH_BATCH_SIZE,
+    SESSION_MAX_LIVE,
+    SESSION_IDLE_TTL,
+    MAX_TRACKED_MESSAGES,
+    WORKERS,
+    BOT_MODE,
+    OUTBOUND_GLOBAL_RATE,
+    OUTBOUND_CHAT_RATE,
+    OUTBOUND_CHAT_BURST,
+    OUTBOUND_GROUP_RATE,
+    OUTBOUND_MAX_RETRIES,
+    EDIT_COALESCE_WINDOW
+)
+import asyncio
+import json
 import logging
-from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import Command
+from datetime import datetime
+from typing import List, Optional
+from aiogram import Bot, Dispatcher, types, F, html
+from aiogram.filters import Command, CommandObject
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.dispatcher.event.bases import SkipHandler
 from aiogram.types import (
     InlineKeyboardMarkup, 
     InlineKeyboardButton, 
-    FSInputFile,
     ReplyKeyboardMarkup,
     KeyboardButton,
-    Chat
+    Chat,
+    InlineQueryResultArticle,
+    InputTextMessageContent
 )
 from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from database import get_categories, get_products_by_category, get_product, initialize_database
-import os
-from admin import setup_admin_handlers
+from async_database import (
+    get_product,
+    get_products,
+    search_products,
+    enqueue_order,
+    initialize_database,
+    close_database
+)
+from admin import setup_admin_handlers, ADMIN_MENU_BUTTONS
+from sessions import SessionStore, SessionMiddleware, new_session
+from fsm_storage import create_fsm_storage
+from photos import has_product_photo, send_product_photo, edit_product_photo
+from outbound import OutboundScheduler
+from keyboards import keyboard_cache
+from edits import EditCoalescer, RenderedMessages
+from outbox import order_outbox
+import workers
+import webhook
+import metrics
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -25,10 +63,43 @@ logger = logging.getLogger(__name__)
 
 # Инициализация бота и диспетчера
 bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-dp = Dispatcher()
 
-# Хранилище данных пользователей
-user_data = {}
+# Все запросы к Telegram проходят через планировщик с лимитами частоты.
+# Воркеры отправляют сообщения независимо, поэтому общий лимит делится между ними
+outbound_scheduler = OutboundScheduler(
+    global_rate=OUTBOUND_GLOBAL_RATE / max(WORKERS, 1),
+    chat_rate=OUTBOUND_CHAT_RATE,
+    chat_burst=OUTBOUND_CHAT_BURST,
+    group_rate=OUTBOUND_GROUP_RATE,
+    max_retries=OUTBOUND_MAX_RETRIES
+)
+bot.session.middleware(outbound_scheduler)
+metrics.register("Исходящие запросы", outbound_scheduler.stats)
+dp = Dispatcher(storage=create_fsm_storage())
+
+# Хранилище данных пользователей (загружается из базы при первом обращении)
+user_data = SessionStore(
+    SESSION_FLUSH_INTERVAL,
+    SESSION_FLUSH_BATCH_SIZE,
+    SESSION_MAX_LIVE,
+    SESSION_IDLE_TTL
+)
+dp.update.outer_middleware(SessionMiddleware(user_data))
+metrics.register("Сессии пользователей", user_data.stats)
+
+# Правки сообщений по кнопкам +/-: не больше одной за EDIT_COALESCE_WINDOW секунд
+edit_coalescer = EditCoalescer(EDIT_COALESCE_WINDOW)
+metrics.register("Правки сообщений", edit_coalescer.stats)
+# Что было отправлено в карточки товаров, чтобы не повторять одинаковые правки
+rendered_messages = RenderedMessages()
+metrics.register("Карточки товаров", rendered_messages.stats)
+
+# Максимальное количество товаров в результатах поиска
+SEARCH_RESULTS_LIMIT = 20
+INLINE_RESULTS_LIMIT = 50
+
+# Сколько сообщений можно удалить одним запросом deleteMessages
+DELETE_MESSAGES_CHUNK = 100
 
 # Состояния для FSM
 class Form(StatesGroup):
@@ -36,65 +107,162 @@ class Form(StatesGroup):
     waiting_for_phone_manual = State()
     waiting_for_address = State()
 
+class SearchForm(StatesGroup):
+    waiting_for_query = State()
+
+# Кнопки главной клавиатуры, по две в ряд
+MAIN_MENU_BUTTONS = ["Каталог", "Поиск", "Корзина", "Доставка", "Онлайн-чат", "Позвонить"]
+
 def get_main_keyboard():
     """Создает главную клавиатуру"""
     builder = ReplyKeyboardBuilder()
-    builder.row(KeyboardButton(text="Каталог"))
-    builder.row(
-        KeyboardButton(text="Корзина"),
-        KeyboardButton(text="Доставка")
-    )
-    builder.row(
-        KeyboardButton(text="Онлайн-чат"),
-        KeyboardButton(text="Позвонить")
-    )
+    for text in MAIN_MENU_BUTTONS:
+        builder.add(KeyboardButton(text=text))
+    builder.adjust(2)
     return builder.as_markup(resize_keyboard=True)
 
-async def update_main_message(chat_id: int, user_id: int, text: str = "Главное меню"):
-    """Обновляет главное сообщение с клавиатурой"""
+async def update_main_message(
+    chat_id: int,
+    user_id: int,
+    text: str = "Главное меню",
+    user_message: Optional[types.Message] = None
+):
+    """Отправляет новое главное сообщение с клавиатурой и удаляет старые сообщения.
+
+    Старое главное сообщение, остальные сообщения бота и сообщение
+    пользователя удаляются одним запросом одновременно с отправкой нового.
+    """
     if user_id not in user_data:
-        user_data[user_id] = {'main_message_id': None, 'other_messages': [], 'cart': {}}
+        user_data[user_id] = new_session()
     
+    stale = take_tracked_messages(user_id)
     if user_data[user_id]['main_message_id']:
-        try:
-            await bot.delete_message(chat_id, user_data[user_id]['main_message_id'])
-        except Exception as e:
-            logger.error(f"Ошибка при удалении сообщения: {e}")
-    
-    sent_message = await bot.send_message(
-        chat_id,
-        text,
-        reply_markup=get_main_keyboard()
+        stale.append(user_data[user_id]['main_message_id'])
+    if user_message:
+        stale.append(user_message.message_id)
+    
+    sent_message, _ = await asyncio.gather(
+        bot.send_message(
+            chat_id,
+            text,
+            reply_markup=get_main_keyboard()
+        ),
+        delete_messages(chat_id, stale)
     )
     user_data[user_id]['main_message_id'] = sent_message.message_id
+    user_data.mark_dirty(user_id)
     return sent_message
 
-async def clean_other_messages(chat_id: int, user_id: int):
+async def clean_other_messages(chat_id: int, user_id: int, user_message: Optional[types.Message] = None):
     """Удаляет все сообщения кроме главного"""
     if user_id in user_data and 'other_messages' in user_data[user_id]:
-        for msg_id in user_data[user_id]['other_messages']:
-            try:
-                await bot.delete_message(chat_id=chat_id, message_id=msg_id)
-            except Exception as e:
-                logger.error(f"Ошибка при удалении сообщения: {e}")
-        user_data[user_id]['other_messages'] = []
+        stale = take_tracked_messages(user_id)
+        if user_message:
+            stale.append(user_message.message_id)
+        await delete_messages(chat_id, stale)
+
+def take_tracked_messages(user_id: int) -> List[int]:
+    """Забирает id сообщений для удаления и сразу очищает список.
+
+    Список очищается до запросов к Telegram, поэтому сообщения, отправленные
+    параллельно другим обработчиком, не потеряются и не удалятся дважды.
+    """
+    messages = user_data[user_id]['other_messages']
+    user_data[user_id]['other_messages'] = []
+    user_data.mark_dirty(user_id)
+    return messages
 
-async def delete_user_message(message: types.Message):
-    """Пытается удалить сообщение пользователя"""
+async def delete_messages(chat_id: int, message_ids: List[int]):
+    """Удаляет сообщения пачками через deleteMessages"""
+    chunks = [
+        message_ids[start:start + DELETE_MESSAGES_CHUNK]
+        for start in range(0, len(message_ids), DELETE_MESSAGES_CHUNK)
+    ]
+    await asyncio.gather(*(_delete_messages_chunk(chat_id, chunk) for chunk in chunks))
+
+async def _delete_messages_chunk(chat_id: int, message_ids: List[int]):
+    try:
+        # Ненайденные сообщения Telegram просто пропускает
+        await bot.delete_messages(chat_id=chat_id, message_ids=message_ids)
+    except Exception as e:
+        logger.error(f"Ошибка при удалении сообщений: {e}")
+        # Удаляем по одному, чтобы ошибка одного id не мешала остальным
+        await asyncio.gather(*(_delete_message(chat_id, message_id) for message_id in message_ids))
+
+async def _delete_message(chat_id: int, message_id: int):
     try:
-        await bot.delete_message(chat_id=message.chat.id, message_id=message.message_id)
+        await bot.delete_message(chat_id=chat_id, message_id=message_id)
     except Exception as e:
         logger.error(f"Ошибка при удалении сообщения: {e}")
 
+def schedule_edit(callback: types.CallbackQuery, render):
+    """Откладывает правку сообщения с кнопкой, склеивая частые нажатия"""
+    edit_coalescer.schedule(callback.message.chat.id, callback.message.message_id, render)
+
+async def leave_message(message: types.Message):
+    """Готовит сообщение к показу другого экрана.
+
+    Отменяет отложенные правки старого экрана и забывает его содержимое,
+    чтобы update_product_message не принял новый экран за карточку товара.
+    """
+    await edit_coalescer.cancel(message.chat.id, message.message_id)
+    rendered_messages.forget(message.chat.id, message.message_id)
+
+async def show_in_place(callback: types.CallbackQuery, text: str, reply_markup: InlineKeyboardMarkup) -> int:
+    """Показывает новый экран каталога в сообщении, на кнопку которого нажали.
+
+    Текстовое сообщение редактируется на месте одним запросом. Сообщение
+    с фото в текстовое не превратить, поэтому в этом случае (и если
+    редактирование не удалось) отправляется новое сообщение, а старое
+    одновременно удаляется. Возвращает id сообщения с новым экраном.
+    """
+    message = callback.message
+    await leave_message(message)
+    if not message.photo:
+        try:
+            await message.edit_text(text, reply_markup=reply_markup)
+            return message.message_id
+        except TelegramBadRequest as e:
+            if "message is not modified" in str(e):
+                return message.message_id
+            logger.error(f"Не удалось отредактировать сообщение: {e}")
+    
+    sent_message, _ = await asyncio.gather(
+        bot.send_message(message.chat.id, text, reply_markup=reply_markup),
+        delete_messages(message.chat.id, [message.message_id])
+    )
+    track_message(callback.from_user.id, sent_message.message_id)
+    return sent_message.message_id
+
+def track_message(user_id: int, message_id: int):
+    """Запоминает сообщение, которое нужно удалить при следующей очистке"""
+    messages = user_data[user_id]['other_messages']
+    messages.append(message_id)
+    # Храним только последние сообщения, чтобы список не рос бесконечно
+    if len(messages) > MAX_TRACKED_MESSAGES:
+        del messages[:-MAX_TRACKED_MESSAGES]
+    user_data.mark_dirty(user_id)
+
+@dp.message(
+    SearchForm.waiting_for_query,
+    F.text.in_(MAIN_MENU_BUTTONS + ADMIN_MENU_BUTTONS) | F.text.startswith("/")
+)
+async def leave_search(message: types.Message, state: FSMContext):
+    """Кнопки меню и команды во время поиска завершают его.
+
+    Сообщение передается дальше и обрабатывается как обычно, а не
+    как поисковый запрос.
+    """
+    await state.clear()
+    raise SkipHandler()
+
 @dp.message(Command("start"))
 async def cmd_start(message: types.Message):
     """Обработчик команды /start"""
     user_id = message.from_user.id
     chat_id = message.chat.id
     
-    await update_main_message(chat_id, user_id, "Добро пожаловать в наш магазин!")
-    await clean_other_messages(chat_id, user_id)
-    await delete_user_message(message)
+    await update_main_message(chat_id, user_id, "Добро пожаловать в наш магазин!", user_message=message)
 
 @dp.message(F.text == "Каталог")
 async def show_catalog_menu(message: types.Message):
@@ -102,25 +270,16 @@ async def show_catalog_menu(message: types.Message):
     user_id = message.from_user.id
     chat_id = message.chat.id
     
-    await update_main_message(chat_id, user_id)
-    await clean_other_messages(chat_id, user_id)
-    await delete_user_message(message)
+    await update_main_message(chat_id, user_id, user_message=message)
     
-    categories = get_categories()
-    builder = InlineKeyboardBuilder()
-    for category_id, category_name in categories.items():
-        builder.add(InlineKeyboardButton(
-            text=category_name,
-            callback_data=f"category_{category_id}"
-        ))
-    builder.adjust(2)
+    keyboard = await keyboard_cache.categories()
     
     sent_message = await bot.send_message(
         chat_id,
         "Выберите категорию товаров:",
-        reply_markup=builder.as_markup()
+        reply_markup=keyboard
     )
-    user_data[user_id]['other_messages'].append(sent_message.message_id)
+    track_message(user_id, sent_message.message_id)
 
 @dp.message(F.text == "Доставка")
 async def show_delivery_info(message: types.Message):
@@ -128,9 +287,7 @@ async def show_delivery_info(message: types.Message):
     user_id = message.from_user.id
     chat_id = message.chat.id
     
-    await update_main_message(chat_id, user_id)
-    await clean_other_messages(chat_id, user_id)
-    await delete_user_message(message)
+    await update_main_message(chat_id, user_id, user_message=message)
     
     delivery_text = (
         "MSK_BAR 24/7\n\n"
@@ -142,7 +299,7 @@ async def show_delivery_info(message: types.Message):
     )
     
     sent_message = await bot.send_message(chat_id, delivery_text)
-    user_data[user_id]['other_messages'].append(sent_message.message_id)
+    track_message(user_id, sent_message.message_id)
 
 @dp.message(F.text == "Позвонить")
 async def show_phone_number(message: types.Message):
@@ -150,15 +307,13 @@ async def show_phone_number(message: types.Message):
     user_id = message.from_user.id
     chat_id = message.chat.id
     
-    await update_main_message(chat_id, user_id)
-    await clean_other_messages(chat_id, user_id)
-    await delete_user_message(message)
+    await update_main_message(chat_id, user_id, user_message=message)
     
     sent_message = await bot.send_message(
         chat_id,
         "Ведутся технические работы"
     )
-    user_data[user_id]['other_messages'].append(sent_message.message_id)
+    track_message(user_id, sent_message.message_id)
 
 @dp.message(F.text == "Онлайн-чат")
 async def show_online_chat(message: types.Message):
@@ -166,12 +321,84 @@ async def show_online_chat(message: types.Message):
     user_id = message.from_user.id
     chat_id = message.chat.id
     
-    await update_main_message(chat_id, user_id)
-    await clean_other_messages(chat_id, user_id)
-    await delete_user_message(message)
+    await update_main_message(chat_id, user_id, user_message=message)
     
     sent_message = await bot.send_message(chat_id, "Ведутся технические работы")
-    user_data[user_id]['other_messages'].append(sent_message.message_id)
+    track_message(user_id, sent_message.message_id)
+
+async def send_search_results(chat_id: int, user_id: int, query: str):
+    """Отправляет найденные по запросу товары кнопками"""
+    products = await search_products(query, SEARCH_RESULTS_LIMIT)
+    
+    builder = InlineKeyboardBuilder()
+    for product in products:
+        builder.add(InlineKeyboardButton(
+            text=f"{product.price}₽ - {product.name}",
+            callback_data=f"product_{product.id}"
+        ))
+    builder.adjust(1)
+    builder.row(InlineKeyboardButton(
+        text="Назад к категориям",
+        callback_data="back_to_categories"
+    ))
+    
+    if products:
+        text = f"Результаты поиска по запросу <b>{html.quote(query)}</b>:"
+    else:
+        text = f"По запросу <b>{html.quote(query)}</b> ничего не найдено"
+    sent_message = await bot.send_message(
+        chat_id,
+        text,
+        reply_markup=builder.as_markup()
+    )
+    track_message(user_id, sent_message.message_id)
+
+@dp.message(Command("search"))
+async def cmd_search(message: types.Message, command: CommandObject, state: FSMContext):
+    """Поиск товаров командой /search <запрос>"""
+    user_id = message.from_user.id
+    chat_id = message.chat.id
+    
+    await update_main_message(chat_id, user_id, user_message=message)
+    
+    if not command.args:
+        sent_message = await bot.send_message(chat_id, "Введите название товара:")
+        track_message(user_id, sent_message.message_id)
+        await state.set_state(SearchForm.waiting_for_query)
+        return
+    
+    await send_search_results(chat_id, user_id, command.args.strip())
+
+@dp.message(F.text == "Поиск")
+async def show_search_prompt(message: types.Message, state: FSMContext):
+    """Запрос поисковой строки"""
+    user_id = message.from_user.id
+    chat_id = message.chat.id
+    
+    await update_main_message(chat_id, user_id, user_message=message)
+    
+    sent_message = await bot.send_message(chat_id, "Введите название товара:")
+    track_message(user_id, sent_message.message_id)
+    await state.set_state(SearchForm.waiting_for_query)
+
+@dp.inline_query()
+async def inline_search(inline_query: types.InlineQuery):
+    """Поиск товаров в инлайн-режиме (@бот запрос)"""
+    query = inline_query.query.strip()
+    products = await search_products(query, INLINE_RESULTS_LIMIT) if query else []
+    
+    results = [
+        InlineQueryResultArticle(
+            id=str(product.id),
+            title=product.name,
+            description=f"{product.price}₽ · {product.category_name}",
+            input_message_content=InputTextMessageContent(
+                message_text=f"<b>{html.quote(product.name)}</b>\n\nЦена: {product.price}₽"
+            )
+        )
+        for product in products
+    ]
+    await inline_query.answer(results, cache_time=60)
 
 @dp.message(F.text == "Корзина")
 async def show_cart(message: types.Message):
@@ -179,24 +406,23 @@ async def show_cart(message: types.Message):
     user_id = message.from_user.id
     chat_id = message.chat.id
     
-    await update_main_message(chat_id, user_id)
-    await clean_other_messages(chat_id, user_id)
-    await delete_user_message(message)
+    await update_main_message(chat_id, user_id, user_message=message)
     
     if not user_data.get(user_id, {}).get('cart'):
         sent_message = await bot.send_message(chat_id, "Корзина пуста")
-        user_data[user_id]['other_messages'].append(sent_message.message_id)
+        track_message(user_id, sent_message.message_id)
         return
     
     # Формируем текст корзины
     cart_text = "Сейчас в Вашей корзине:\n\n"
     total = 0
+    products = await get_products(user_data[user_id]['cart'].keys())
     
     for product_id, quantity in user_data[user_id]['cart'].items():
-        product = get_product(product_id)
+        product = products.get(product_id)
         if product:
-            product_total = quantity * product['price']
-            cart_text += f"{product['name']}: {product['price']} Руб x {quantity}\n"
+            product_total = quantity * product.price
+            cart_text += f"{product.name}: {product.price} Руб x {quantity}\n"
             total += product_total
     
     cart_text += f"\nСумма без доставки: {total} Руб"
@@ -214,7 +440,7 @@ async def show_cart(message: types.Message):
         cart_text,
         reply_markup=keyboard
     )
-    user_data[user_id]['other_messages'].append(sent_message.message_id)
+    track_message(user_id, sent_message.message_id)
 
 @dp.callback_query(F.data == "edit_cart")
 async def edit_cart(callback: types.CallbackQuery):
@@ -234,12 +460,13 @@ async def edit_cart(callback: types.CallbackQuery):
     
     # Создаем клавиатуру с товарами для редактирования
     builder = InlineKeyboardBuilder()
+    products = await get_products(user_data[user_id]['cart'].keys())
     
     for product_id, quantity in user_data[user_id]['cart'].items():
-        product = get_product(product_id)
+        product = products.get(product_id)
         if product:
             builder.add(InlineKeyboardButton(
-                text=f"{product['name']} ({quantity})",  # Добавляем количество в скобках
+                text=f"{product.name} ({quantity})",  # Добавляем количество в скобках
                 callback_data=f"edit_item_{product_id}"
             ))
     
@@ -256,7 +483,7 @@ async def edit_cart(callback: types.CallbackQuery):
         "Выберите товар, который нужно изменить:",
         reply_markup=builder.as_markup()
     )
-    user_data[user_id]['other_messages'].append(sent_message.message_id)
+    track_message(user_id, sent_message.message_id)
     await callback.answer()
 
 @dp.callback_query(F.data.startswith("edit_item_"))
@@ -267,21 +494,33 @@ async def edit_item(callback: types.CallbackQuery):
     except IndexError:
         product_id = int(callback.data.split("_")[1])
     
-    product = get_product(product_id)
-    user_id = callback.from_user.id
-    
-    if not product or user_id not in user_data or product_id not in user_data[user_id]['cart']:
+    await leave_message(callback.message)
+    if not await show_cart_item(callback, product_id):
         await callback.answer("Товар не найден")
         return
+    await callback.answer()
+
+async def show_cart_item(callback: types.CallbackQuery, product_id: int, quantity: Optional[int] = None) -> bool:
+    """Показывает товар из корзины с кнопками редактирования. False, если товара нет в корзине.
+
+    quantity передается отложенными правками: они выполняются вне SessionMiddleware,
+    когда сессии пользователя в памяти уже может не быть.
+    """
+    product = await get_product(product_id)
+    user_id = callback.from_user.id
     
-    quantity = user_data[user_id]['cart'][product_id]
-    total_price = quantity * product['price']
+    if quantity is None:
+        quantity = user_data.get(user_id, {}).get('cart', {}).get(product_id)
+    if not product or quantity is None:
+        return False
+    
+    total_price = quantity * product.price
     
     # Формируем текст сообщения
     text = (
-        f"Просмотр товара в категории: {get_categories().get(product['category'], 'Без категории')}\n\n"
-        f"<b>{product['name']}</b>\n\n"
-        f"Цена: {product['price']} Руб.\n"
+        f"Просмотр товара в категории: {product.category_name or 'Без категории'}\n\n"
+        f"<b>{product.name}</b>\n\n"
+        f"Цена: {product.price} Руб.\n"
         f"Количество: {quantity}\n"
         f"Итого: {total_price} Руб."
     )
@@ -290,7 +529,7 @@ async def edit_item(callback: types.CallbackQuery):
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [
             InlineKeyboardButton(
-                text=f"{product['price']} Руб × {quantity} = {total_price} Руб", 
+                text=f"{product.price} Руб × {quantity} = {total_price} Руб", 
                 callback_data="no_action"
             )
         ],
@@ -308,20 +547,21 @@ async def edit_item(callback: types.CallbackQuery):
     ])
     
     try:
-        # Формируем полный путь к изображению
-        image_path = os.path.join(IMAGE_FOLDER, product['image_url']) if product.get('image_url') else None
-        
-        if not callback.message.photo and image_path and os.path.exists(image_path):
-            photo = FSInputFile(image_path)
+        if not callback.message.photo and has_product_photo(product):
             await callback.message.delete()
-            sent_message = await bot.send_photo(
-                chat_id=callback.message.chat.id,
-                photo=photo,
+            sent_message = await send_product_photo(
+                bot,
+                callback.message.chat.id,
+                product,
                 caption=text,
                 reply_markup=keyboard
             )
-            user_data[user_id]['other_messages'].append(sent_message.message_id)
+            if sent_message:
+                track_message(user_id, sent_message.message_id)
         else:
+            # Экран в сообщении меняется (может выполняться и как отложенная правка,
+            # поэтому без leave_message)
+            rendered_messages.forget(callback.message.chat.id, callback.message.message_id)
             if callback.message.photo:
                 await callback.message.edit_caption(
                     caption=text,
@@ -334,9 +574,7 @@ async def edit_item(callback: types.CallbackQuery):
                 )
     except Exception as e:
         logger.error(f"Ошибка при отображении товара: {e}")
-        await callback.answer("Произошла ошибка при отображении товара")
-    finally:
-        await callback.answer()
+    return True
 
 @dp.callback_query(F.data == "back_to_cart_from_edit")
 async def back_to_cart_from_edit(callback: types.CallbackQuery):
@@ -345,6 +583,7 @@ async def back_to_cart_from_edit(callback: types.CallbackQuery):
     chat_id = callback.message.chat.id
     
     # Удаляем текущее сообщение с редактированием товара
+    await leave_message(callback.message)
     try:
         await bot.delete_message(chat_id=chat_id, message_id=callback.message.message_id)
     except Exception as e:
@@ -375,9 +614,12 @@ async def decrease_product(callback: types.CallbackQuery):
         if product_id in user_data[user_id]['cart']:
             if user_data[user_id]['cart'][product_id] > 1:
                 user_data[user_id]['cart'][product_id] -= 1
-                await edit_item(callback)
+                user_data.mark_dirty(user_id)
+                quantity = user_data[user_id]['cart'][product_id]
+                schedule_edit(callback, lambda: show_cart_item(callback, product_id, quantity))
             else:
                 del user_data[user_id]['cart'][product_id]
+                user_data.mark_dirty(user_id)
                 await callback.answer("Товар удален")
                 await back_to_edit_cart(callback)
     
@@ -396,7 +638,9 @@ async def increase_product(callback: types.CallbackQuery):
     if user_id in user_data and 'cart' in user_data[user_id]:
         if product_id in user_data[user_id]['cart']:
             user_data[user_id]['cart'][product_id] += 1
-            await edit_item(callback)
+            user_data.mark_dirty(user_id)
+            quantity = user_data[user_id]['cart'][product_id]
+            schedule_edit(callback, lambda: show_cart_item(callback, product_id, quantity))
     
     await callback.answer()
 
@@ -413,6 +657,7 @@ async def remove_product(callback: types.CallbackQuery):
     if user_id in user_data and 'cart' in user_data[user_id]:
         if product_id in user_data[user_id]['cart']:
             del user_data[user_id]['cart'][product_id]
+            user_data.mark_dirty(user_id)
             await callback.answer("Товар удален")
             await back_to_edit_cart(callback)
     
@@ -423,38 +668,40 @@ async def refresh_cart_message(callback: types.CallbackQuery):
     user_id = callback.from_user.id
     chat_id = callback.message.chat.id
     
+    await leave_message(callback.message)
     if user_id not in user_data or 'cart' not in user_data[user_id] or not user_data[user_id]['cart']:
         await callback.message.edit_text("Ваша корзина пуста!")
         return
     
     cart_text = "Ваша корзина:\n\n"
     total = 0
+    products = await get_products(user_data[user_id]['cart'].keys())
     for product_id, quantity in user_data[user_id]['cart'].items():
-        product = get_product(product_id)
+        product = products.get(product_id)
         if product:
-            cart_text += f"{product['name']} - {quantity} шт. x {product['price']}₽ = {quantity * product['price']}₽\n"
-            total += quantity * product['price']
+            cart_text += f"{product.name} - {quantity} шт. x {product.price}₽ = {quantity * product.price}₽\n"
+            total += quantity * product.price
     
     cart_text += f"\nИтого: {total}₽"
     
     builder = InlineKeyboardBuilder()
     
     for product_id in user_data[user_id]['cart'].keys():
-        product = get_product(product_id)
+        product = products.get(product_id)
         if product:
             builder.row(
                 InlineKeyboardButton(
-                    text=f"- {product['name']}",
+                    text=f"- {product.name}",
                     callback_data=f"cart_decrease_{product_id}"
                 ),
                 InlineKeyboardButton(
-                    text=f"+ {product['name']}",
+                    text=f"+ {product.name}",
                     callback_data=f"cart_increase_{product_id}"
                 )
             )
             builder.row(
                 InlineKeyboardButton(
-                    text=f"Удалить {product['name']}",
+                    text=f"Удалить {product.name}",
                     callback_data=f"cart_remove_{product_id}"
                 )
             )
@@ -482,65 +729,27 @@ async def refresh_cart_message(callback: types.CallbackQuery):
 @dp.callback_query(F.data.startswith("category_"))
 async def show_category_products(callback: types.CallbackQuery):
     """Показ товаров в категории"""
-    user_id = callback.from_user.id
-    chat_id = callback.message.chat.id
-    
-    await update_main_message(chat_id, user_id)
-    await clean_other_messages(chat_id, user_id)
-    
     category_id = callback.data.split("_")[1]
-    categories = get_categories()
-    category_name = categories.get(category_id, "Неизвестная категория")
-    category_products = get_products_by_category(category_id)
+    entry = await keyboard_cache.category_products(category_id)
     
-    if not category_products:
+    if not entry:
         await callback.answer("В этой категории пока нет товаров")
         return
     
-    builder = InlineKeyboardBuilder()
-    for product_id, product in category_products.items():
-        builder.add(InlineKeyboardButton(
-            text=f"{product['price']}₽ - {product['name']}",
-            callback_data=f"product_{product_id}"
-        ))
-    builder.adjust(1)
-    builder.row(InlineKeyboardButton(
-        text="Назад к категориям",
-        callback_data="back_to_categories"
-    ))
-    
-    sent_message = await bot.send_message(
-        chat_id,
+    category_name, keyboard = entry
+    await show_in_place(
+        callback,
         f"Товары в категории <b>{category_name}</b>:",
-        reply_markup=builder.as_markup()
+        keyboard
     )
-    user_data[user_id]['other_messages'].append(sent_message.message_id)
     await callback.answer()
 
 @dp.callback_query(F.data == "back_to_categories")
 async def back_to_categories(callback: types.CallbackQuery):
     """Возврат к списку категорий"""
-    user_id = callback.from_user.id
-    chat_id = callback.message.chat.id
-    
-    await update_main_message(chat_id, user_id)
-    await clean_other_messages(chat_id, user_id)
-    
-    categories = get_categories()
-    builder = InlineKeyboardBuilder()
-    for category_id, category_name in categories.items():
-        builder.add(InlineKeyboardButton(
-            text=category_name,
-            callback_data=f"category_{category_id}"
-        ))
-    builder.adjust(2)
+    keyboard = await keyboard_cache.categories()
     
-    sent_message = await bot.send_message(
-        chat_id,
-        "Выберите категорию товаров:",
-        reply_markup=builder.as_markup()
-    )
-    user_data[user_id]['other_messages'].append(sent_message.message_id)
+    await show_in_place(callback, "Выберите категорию товаров:", keyboard)
     await callback.answer()
     
 @dp.callback_query(F.data.startswith("product_"))
@@ -549,7 +758,7 @@ async def show_product(callback: types.CallbackQuery):
     try:
         user_id = callback.from_user.id
         product_id = int(callback.data.split("_")[1])
-        product = get_product(product_id)
+        product = await get_product(product_id)
         
         if not product:
             await callback.answer("Товар не найден")
@@ -560,58 +769,38 @@ async def show_product(callback: types.CallbackQuery):
         
         current_quantity = user_data.get(user_id, {}).get('cart', {}).get(product_id, 0)
         
-        # Создаем клавиатуру
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [
-                InlineKeyboardButton(text="-", callback_data=f"decrease_{product_id}"),
-                InlineKeyboardButton(text=str(current_quantity), callback_data="no_action"),
-                InlineKeyboardButton(text="+", callback_data=f"increase_{product_id}")
-            ],
-            [InlineKeyboardButton(text="Добавить в корзину", callback_data=f"add_{product_id}")],
-            [InlineKeyboardButton(text="Добавили? Оформляем заказ?", callback_data="checkout")],
-            [InlineKeyboardButton(text="... или продолжить покупки?", callback_data="continue_shopping")],
-            [InlineKeyboardButton(text="Назад", callback_data=f"category_{product['category']}")]
-        ])
-
-        # Пытаемся отправить фото, если оно есть
-        if product.get('image_url'):
-            image_path = os.path.join(IMAGE_FOLDER, product['image_url'])
-            logger.info(f"Trying to load image from: {image_path}")
-            
-            if os.path.exists(image_path):
-                try:
-                    await callback.message.delete()
-                    photo = FSInputFile(image_path)
-                    sent_message = await bot.send_photo(
-                        chat_id=callback.message.chat.id,
-                        photo=photo,
-                        caption=f"<b>{product['name']}</b>\n\nЦена: {product['price']}₽",
-                        reply_markup=keyboard
-                    )
-                    
+        keyboard = product_card_keyboard(product, current_quantity)
+        caption = product_card_text(product)
+        chat_id = callback.message.chat.id
+        await leave_message(callback.message)
+        
+        # Пытаемся показать фото, если оно есть
+        if has_product_photo(product):
+            # Фото в сообщении с фото заменяется на месте
+            if callback.message.photo and await edit_product_photo(callback.message, product, caption, keyboard):
+                rendered_messages.remember(chat_id, callback.message.message_id, caption, keyboard)
+                await callback.answer()
+                return
+            try:
+                sent_message, _ = await asyncio.gather(
+                    send_product_photo(bot, chat_id, product, caption=caption, reply_markup=keyboard),
+                    delete_messages(chat_id, [callback.message.message_id])
+                )
+                if sent_message:
                     # Сохраняем ID сообщения
                     if user_id not in user_data:
-                        user_data[user_id] = {'main_message_id': None, 'other_messages': [], 'cart': {}}
-                    user_data[user_id]['other_messages'].append(sent_message.message_id)
-                    
+                        user_data[user_id] = new_session()
+                    track_message(user_id, sent_message.message_id)
+                    rendered_messages.remember(chat_id, sent_message.message_id, caption, keyboard)
+
                     await callback.answer()
                     return
-                except Exception as e:
-                    logger.error(f"Error sending photo: {e}")
-
-        # Если фото нет или не удалось отправить - отправляем текстовое сообщение
-        await callback.message.delete()
-        sent_message = await bot.send_message(
-            chat_id=callback.message.chat.id,
-            text=f"<b>{product['name']}</b>\n\nЦена: {product['price']}₽",
-            reply_markup=keyboard
-        )
-        
-        # Сохраняем ID сообщения
-        if user_id not in user_data:
-            user_data[user_id] = {'main_message_id': None, 'other_messages': [], 'cart': {}}
-        user_data[user_id]['other_messages'].append(sent_message.message_id)
-        
+            except Exception as e:
+                logger.error(f"Error sending photo: {e}")
+
+        # Если фото нет или не удалось отправить - показываем текст
+        message_id = await show_in_place(callback, caption, keyboard)
+        rendered_messages.remember(chat_id, message_id, caption, keyboard)
         await callback.answer()
         
     except Exception as e:
@@ -621,27 +810,9 @@ async def show_product(callback: types.CallbackQuery):
 @dp.callback_query(F.data == "continue_shopping")
 async def continue_shopping(callback: types.CallbackQuery):
     """Обработчик кнопки 'Продолжить покупки'"""
-    user_id = callback.from_user.id
-    chat_id = callback.message.chat.id
+    keyboard = await keyboard_cache.categories()
     
-    await update_main_message(chat_id, user_id)
-    await clean_other_messages(chat_id, user_id)
-    
-    categories = get_categories()
-    builder = InlineKeyboardBuilder()
-    for category_id, category_name in categories.items():
-        builder.add(InlineKeyboardButton(
-            text=category_name,
-            callback_data=f"category_{category_id}"
-        ))
-    builder.adjust(2)
-    
-    sent_message = await bot.send_message(
-        chat_id,
-        "Выберите категорию товаров:",
-        reply_markup=builder.as_markup()
-    )
-    user_data[user_id]['other_messages'].append(sent_message.message_id)
+    await show_in_place(callback, "Выберите категорию товаров:", keyboard)
     await callback.answer()
 
 @dp.callback_query(F.data.startswith("add_"))
@@ -651,7 +822,7 @@ async def add_to_cart(callback: types.CallbackQuery):
     product_id = int(callback.data.split("_")[1])
     
     if user_id not in user_data:
-        user_data[user_id] = {'main_message_id': None, 'other_messages': [], 'cart': {}}
+        user_data[user_id] = new_session()
     
     if 'cart' not in user_data[user_id]:
         user_data[user_id]['cart'] = {}
@@ -659,40 +830,12 @@ async def add_to_cart(callback: types.CallbackQuery):
     # Добавляем товар с количеством 1 (вместо увеличения на 1)
     if product_id not in user_data[user_id]['cart']:
         user_data[user_id]['cart'][product_id] = 1
+        user_data.mark_dirty(user_id)
     
     await callback.answer(f"Товар добавлен в корзину! Текущее количество: {user_data[user_id]['cart'][product_id]}")
     
     # Обновляем сообщение с товаром, чтобы счетчик отобразил 1
-    product = get_product(product_id)
-    if product:
-        current_quantity = user_data[user_id]['cart'].get(product_id, 0)
-        
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [
-                InlineKeyboardButton(text="-", callback_data=f"decrease_{product_id}"),
-                InlineKeyboardButton(text=str(current_quantity), callback_data="no_action"), 
-                InlineKeyboardButton(text="+", callback_data=f"increase_{product_id}")
-            ],
-            [InlineKeyboardButton(text="Добавить в корзину", callback_data=f"add_{product_id}")],
-            [
-                InlineKeyboardButton(text="Добавили? Оформляем заказ?", callback_data="checkout")
-            ],
-            [InlineKeyboardButton(text="... или продолжить покупки?", callback_data="continue_shopping")],
-            [InlineKeyboardButton(text="Назад", callback_data=f"category_{product['category']}")]
-        ])
-        try:
-            if callback.message.photo:
-                await callback.message.edit_caption(
-                    caption=f"<b>{product['name']}</b>\n\nЦена: {product['price']}₽",
-                    reply_markup=keyboard
-                )
-            else:
-                await callback.message.edit_text(
-                    text=f"<b>{product['name']}</b>\n\nЦена: {product['price']}₽",
-                    reply_markup=keyboard
-                )
-        except Exception as e:
-            logger.error(f"Ошибка при обновлении сообщения: {e}")
+    await update_product_message(callback, product_id)
 
 @dp.callback_query(F.data.startswith("increase_"))
 async def increase_quantity(callback: types.CallbackQuery):
@@ -701,16 +844,18 @@ async def increase_quantity(callback: types.CallbackQuery):
     product_id = int(callback.data.split("_")[1])
     
     if user_id not in user_data:
-        user_data[user_id] = {'main_message_id': None, 'other_messages': [], 'cart': {}}
+        user_data[user_id] = new_session()
     
     if 'cart' not in user_data[user_id]:
         user_data[user_id]['cart'] = {}
     
     # Увеличиваем количество на 1
     user_data[user_id]['cart'][product_id] = user_data[user_id]['cart'].get(product_id, 0) + 1
+    user_data.mark_dirty(user_id)
+    quantity = user_data[user_id]['cart'][product_id]
     
-    # Обновляем сообщение
-    await update_product_message(callback, product_id)
+    # Обновляем сообщение (частые нажатия склеиваются в одну правку)
+    schedule_edit(callback, lambda: update_product_message(callback, product_id, quantity))
     await callback.answer()
 
 @dp.callback_query(F.data.startswith("decrease_"))
@@ -725,46 +870,74 @@ async def decrease_quantity(callback: types.CallbackQuery):
                 user_data[user_id]['cart'][product_id] -= 1
             else:
                 del user_data[user_id]['cart'][product_id]
+            user_data.mark_dirty(user_id)
+    quantity = user_data.get(user_id, {}).get('cart', {}).get(product_id, 0)
     
-    # Обновляем сообщение
-    await update_product_message(callback, product_id)
+    # Обновляем сообщение (частые нажатия склеиваются в одну правку)
+    schedule_edit(callback, lambda: update_product_message(callback, product_id, quantity))
     await callback.answer()
 
-async def update_product_message(callback: types.CallbackQuery, product_id: int):
-    """Обновляет сообщение с товаром"""
+def product_card_text(product) -> str:
+    """Текст карточки товара"""
+    return f"<b>{product.name}</b>\n\nЦена: {product.price}₽"
+
+def product_card_keyboard(product, quantity: int) -> InlineKeyboardMarkup:
+    """Клавиатура карточки товара со счетчиком количества"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text="-", callback_data=f"decrease_{product.id}"),
+            InlineKeyboardButton(text=str(quantity), callback_data="no_action"),
+            InlineKeyboardButton(text="+", callback_data=f"increase_{product.id}")
+        ],
+        [InlineKeyboardButton(text="Добавить в корзину", callback_data=f"add_{product.id}")],
+        [InlineKeyboardButton(text="Добавили? Оформляем заказ?", callback_data="checkout")],
+        [InlineKeyboardButton(text="... или продолжить покупки?", callback_data="continue_shopping")],
+        [InlineKeyboardButton(text="Назад", callback_data=f"category_{product.category}")]
+    ])
+
+async def update_product_message(callback: types.CallbackQuery, product_id: int, quantity: Optional[int] = None):
+    """Обновляет сообщение с товаром.
+
+    Если изменился только счетчик, меняются только кнопки, а если
+    не изменилось ничего - запрос к Telegram не отправляется.
+    quantity передается отложенными правками, как и в show_cart_item.
+    """
     user_id = callback.from_user.id
-    product = get_product(product_id)
+    product = await get_product(product_id)
     
     if not product:
         return
     
-    current_quantity = user_data[user_id].get('cart', {}).get(product_id, 0)
+    if quantity is None:
+        quantity = user_data.get(user_id, {}).get('cart', {}).get(product_id, 0)
+    text = product_card_text(product)
+    keyboard = product_card_keyboard(product, quantity)
     
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text="-", callback_data=f"decrease_{product_id}"),
-            InlineKeyboardButton(text=str(current_quantity), callback_data="no_action"), 
-            InlineKeyboardButton(text="+", callback_data=f"increase_{product_id}")
-        ],
-        [InlineKeyboardButton(text="Добавить в корзину", callback_data=f"add_{product_id}")],
-        [
-            InlineKeyboardButton(text="Добавили? Оформляем заказ?", callback_data="checkout")
-        ],
-        [InlineKeyboardButton(text="... или продолжить покупки?", callback_data="continue_shopping")],
-        [InlineKeyboardButton(text="Назад", callback_data=f"category_{product['category']}")]
-    ])
+    message = callback.message
+    last = rendered_messages.get(message.chat.id, message.message_id)
+    if last is None and message.reply_markup == keyboard:
+        # Состояние сообщения неизвестно, но кнопки в нем уже такие же
+        last = (text, keyboard)
     
     try:
-        if callback.message.photo:
-            await callback.message.edit_caption(
-                caption=f"<b>{product['name']}</b>\n\nЦена: {product['price']}₽",
-                reply_markup=keyboard
-            )
+        if last == (text, keyboard):
+            rendered_messages.skipped += 1
+            return
+        if last is not None and last[0] == text:
+            await message.edit_reply_markup(reply_markup=keyboard)
+            rendered_messages.markup_edits += 1
+        elif message.photo:
+            await message.edit_caption(caption=text, reply_markup=keyboard)
+            rendered_messages.full_edits += 1
         else:
-            await callback.message.edit_text(
-                text=f"<b>{product['name']}</b>\n\nЦена: {product['price']}₽",
-                reply_markup=keyboard
-            )
+            await message.edit_text(text=text, reply_markup=keyboard)
+            rendered_messages.full_edits += 1
+        rendered_messages.remember(message.chat.id, message.message_id, text, keyboard)
+    except TelegramBadRequest as e:
+        if "message is not modified" in str(e):
+            rendered_messages.remember(message.chat.id, message.message_id, text, keyboard)
+        else:
+            logger.error(f"Ошибка при обновлении сообщения: {e}")
     except Exception as e:
         logger.error(f"Ошибка при обновлении сообщения: {e}")
 
@@ -786,11 +959,12 @@ async def checkout(callback: types.CallbackQuery, state: FSMContext):
     # Формируем текст заказа
     order_text = "Ваш заказ:\n\n"
     total = 0
+    products = await get_products(user_data[user_id]['cart'].keys())
     for product_id, quantity in user_data[user_id]['cart'].items():
-        product = get_product(product_id)
+        product = products.get(product_id)
         if product:
-            order_text += f"{product['name']} - {quantity} шт. x {product['price']}₽ = {quantity * product['price']}₽\n"
-            total += quantity * product['price']
+            order_text += f"{product.name} - {quantity} шт. x {product.price}₽ = {quantity * product.price}₽\n"
+            total += quantity * product.price
     
     order_text += f"\nИтого: {total}₽\n\n"
     order_text += "Пожалуйста, введите ваш номер телефона в формате 89991234567:"
@@ -831,8 +1005,9 @@ async def process_manual_phone(message: types.Message, state: FSMContext):
     # Сохраняем номер телефона
     user_id = message.from_user.id
     if user_id not in user_data:
-        user_data[user_id] = {}
+        user_data[user_id] = new_session()
     user_data[user_id]['phone'] = phone_number
+    user_data.mark_dirty(user_id)
     
     # Запрашиваем адрес доставки
     await message.reply( 
@@ -853,8 +1028,9 @@ async def save_phone_and_request_address(message: types.Message, phone_number: s
     
     # Сохраняем номер телефона
     if user_id not in user_data:
-        user_data[user_id] = {}
+        user_data[user_id] = new_session()
     user_data[user_id]['phone'] = phone_number
+    user_data.mark_dirty(user_id)
     
     # Запрашиваем адрес доставки
     await message.reply(
@@ -885,30 +1061,44 @@ async def process_address(message: types.Message, state: FSMContext):
     
     # Сохраняем адрес
     if user_id not in user_data:
-        user_data[user_id] = {}
+        user_data[user_id] = new_session()
     user_data[user_id]['address'] = address
+    user_data.mark_dirty(user_id)
     
     # Формируем финальное сообщение с заказом
     order_text = "Заказ принят! Начинаем собирать!\n\n"
     total = 0
+    items = []
+    products = await get_products(user_data[user_id]['cart'].keys())
     for product_id, quantity in user_data[user_id]['cart'].items():
-        product = get_product(product_id)
+        product = products.get(product_id)
         if product:
-            order_text += f"{product['name']} - {quantity} шт. x {product['price']}₽ = {quantity * product['price']}₽\n"
-            total += quantity * product['price']
+            order_text += f"{product.name} - {quantity} шт. x {product.price}₽ = {quantity * product.price}₽\n"
+            total += quantity * product.price
+            items.append({'name': product.name, 'quantity': quantity, 'price': product.price})
     
+    phone = user_data[user_id].get('phone', 'не указан')
     order_text += f"\nИтого: {total}₽\n\n"
-    order_text += f"Номер телефона: {user_data[user_id].get('phone', 'не указан')}\n"
+    order_text += f"Номер телефона: {phone}\n"
     order_text += f"Адрес доставки: {address}\n\n"
     order_text += "Курьер может позвонить для уточнения деталей заказа!"
     
-    # Пытаемся сохранить заказ в Google Таблицу
-    success = await add_order_to_sheet(user_data, user_id)
-    if not success:
+    # Сохраняем снимок заказа в очередь, в Google Таблицу его выгрузит order_outbox
+    order = {
+        'created_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'phone': phone,
+        'address': address,
+        'items': items,
+        'total': total
+    }
+    if await enqueue_order(user_id, json.dumps(order, ensure_ascii=False)):
+        order_outbox.notify()
+    else:
         order_text += "\n\n⚠ Произошла ошибка при сохранении заказа. Пожалуйста, свяжитесь с оператором."
     
     # Очищаем корзину после оформления
     user_data[user_id]['cart'] = {}
+    user_data.mark_dirty(user_id)
     
     await bot.send_message(
         chat_id,
@@ -925,9 +1115,7 @@ async def back_to_main_menu(message: types.Message):
     user_id = message.from_user.id
     chat_id = message.chat.id
     
-    await update_main_message(chat_id, user_id)
-    await clean_other_messages(chat_id, user_id)
-    await delete_user_message(message)
+    await update_main_message(chat_id, user_id, user_message=message)
 
 @dp.callback_query(F.data == "clear_cart")
 async def clear_cart(callback: types.CallbackQuery):
@@ -937,6 +1125,7 @@ async def clear_cart(callback: types.CallbackQuery):
     
     if user_id in user_data and 'cart' in user_data[user_id]:
         user_data[user_id]['cart'] = {}
+        user_data.mark_dirty(user_id)
     
     await callback.answer("Корзина очищена!")
     
@@ -950,77 +1139,75 @@ async def clear_cart(callback: types.CallbackQuery):
     )
     await show_cart(fake_message)
 
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-from datetime import datetime
-from config import GOOGLE_SHEETS_CREDENTIALS_FILE, GOOGLE_SHEET_NAME, GOOGLE_SHEET_WORKSHEET
-
-def setup_google_sheets():
-    """Настройка подключения к Google Sheets"""
-    scope = ['https://spreadsheets.google.com/feeds',
-             'https://www.googleapis.com/auth/drive']
-    creds = ServiceAccountCredentials.from_json_keyfile_name(GOOGLE_SHEETS_CREDENTIALS_FILE, scope)
-    client = gspread.authorize(creds)
-    sheet = client.open(GOOGLE_SHEET_NAME).worksheet(GOOGLE_SHEET_WORKSHEET)
-    return sheet
-
-async def add_order_to_sheet(user_data: dict, user_id: int):
-    """Добавление заказа с автоподбором ширины для столбцов Товары и Адрес"""
-    try:
-        sheet = setup_google_sheets()
-        
-        # Получаем данные
-        user_info = user_data.get(user_id, {})
-        cart = user_info.get('cart', {})
-        phone = user_info.get('phone', 'не указан')
-        address = user_info.get('address', 'не указан')
-        
-        # Формируем список товаров
-        products = []
-        total = 0
-        for product_id, quantity in cart.items():
-            product = get_product(product_id)
-            if product:
-                product_total = quantity * product['price']
-                products.append(
-                    f"• {product['name']} ({quantity}шт × {product['price']}₽ = {product_total}₽)"
-                )
-                total += product_total
-        
-        # Подготавливаем данные
-        order_data = [
-            datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            phone,
-            address,  # Адрес (будет динамически подстраиваться)
-            "\n".join(products),  # Товары с переносами
-            f"{total}₽"
-        ]
-        
-        # Добавляем строку
-        sheet.append_row(order_data)
-        
-        # Настройки форматирования
-        last_row = len(sheet.get_all_values())
-        
-        # Для столбца C (Адрес) и D (Товары)
-        sheet.format(f"C{last_row}:D{last_row}", {
-            "wrapStrategy": "WRAP",
-            "verticalAlignment": "TOP"
-        })
-        
-        # Автоподбор ширины только для нужных столбцов (C и D)
-        sheet.columns_auto_resize(2, 3)  # Столбцы C (2) и D (3)
-        
-        return True
-    except Exception as e:
-        logger.error(f"Ошибка при добавлении заказа: {e}")
-        return False
+@dp.message(SearchForm.waiting_for_query, F.text)
+async def process_search_query(message: types.Message, state: FSMContext):
+    """Поиск товаров по введенному названию"""
+    # Кнопки меню и команды сюда не попадают, их забирает leave_search
+    user_id = message.from_user.id
+    chat_id = message.chat.id
     
-async def main():
-    initialize_database()
+    await state.clear()
+    await clean_other_messages(chat_id, user_id, user_message=message)
+    await send_search_results(chat_id, user_id, message.text.strip())
+
+async def on_startup():
+    await initialize_database()
     await setup_admin_handlers(dp)
-    await dp.start_polling(bot)
+    await user_data.start()
+    order_outbox.start()
+
+async def on_shutdown():
+    await edit_coalescer.close()
+    await user_data.stop()
+    await dp.storage.close()
+    await order_outbox.stop()
+    await close_database()
+
+async def run_worker(index: int, update_queue, processed):
+    """Обрабатывает апдейты, которые ingress направил этому воркеру"""
+    await on_startup()
+    try:
+        await workers.serve_updates(bot, dp, index, update_queue, processed)
+    finally:
+        await on_shutdown()
+        await bot.session.close()
+
+def worker_main(index: int, update_queue, dispatched, processed, catalog_version):
+    """Точка входа процесса-воркера"""
+    workers.init_worker_process(index, dispatched, processed, catalog_version)
+    asyncio.run(run_worker(index, update_queue, processed))
+
+async def run_ingress():
+    """Получает апдейты и распределяет их по воркерам по id пользователя"""
+    # Миграции выполняем один раз до запуска воркеров
+    await initialize_database()
+    await close_database()
+    await setup_admin_handlers(dp)
+    pool = workers.WorkerPool(worker_main, WORKERS)
+    pool.start()
+    try:
+        if BOT_MODE == 'webhook':
+            await webhook.run_webhook_ingress(bot, pool, dp.resolve_used_update_types())
+        else:
+            await workers.poll_updates(bot, pool, dp.resolve_used_update_types())
+    finally:
+        await pool.stop()
+        await bot.session.close()
+
+async def main():
+    if WORKERS > 1:
+        await run_ingress()
+        return
+    await on_startup()
+    try:
+        if BOT_MODE == 'webhook':
+            await webhook.run_webhook(bot, dp)
+        else:
+            # start_polling сам вебхук не снимает, а с ним getUpdates не работает
+            await bot.delete_webhook(drop_pending_updates=False)
+            await dp.start_polling(bot)
+    finally:
+        await on_shutdown()
 
 if __name__ == "__main__":
-    import asyncio
     asyncio.run(main())
@@ -0,0 +1,21 @@
+from typing import Callable, Dict
+
+# Источники статистики для команды /stats: название -> функция, возвращающая счетчики
+_sources: Dict[str, Callable[[], Dict[str, int]]] = {}
+
+def register(name: str, source: Callable[[], Dict[str, int]]):
+    """Регистрирует источник статистики"""
+    _sources[name] = source
+
+def collect() -> Dict[str, Dict[str, int]]:
+    """Собирает текущие значения всех счетчиков"""
+    return {name: source() for name, source in _sources.items()}
+
+def format_stats() -> str:
+    """Возвращает статистику в виде текста для сообщения"""
+    lines = []
+    for name, values in collect().items():
+        lines.append(f"<b>{name}</b>")
+        lines.extend(f"{key}: {value}" for key, value in values.items())
+        lines.append("")
+    return "\n".join(lines).strip() or "Статистика пока не собрана"
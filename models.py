@@ -0,0 +1,20 @@
+from typing import NamedTuple, Optional
+
+# Записи каталога - неизменяемые кортежи с именованными полями. Они занимают
+# меньше памяти, чем словари, и создаются прямо из строк результата запроса,
+# поэтому их можно безопасно хранить в кэше и передавать между обработчиками.
+
+class Category(NamedTuple):
+    id: int
+    category_id: str
+    name: str
+
+class Product(NamedTuple):
+    id: int
+    name: str
+    price: int
+    image_url: Optional[str]
+    category: str
+    category_name: Optional[str]
+    # file_id фото в Telegram после первой отправки, чтобы не загружать файл повторно
+    image_file_id: Optional[str]
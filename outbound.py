@@ -0,0 +1,224 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import Counter, OrderedDict
+from contextvars import ContextVar
+from typing import Dict, List, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import DeleteMessage, DeleteMessages, Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты запросов: чем меньше число, тем раньше запрос получит очередь
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+# Фоновые запросы, которые могут подождать ответов пользователям
+BACKGROUND_METHODS = (DeleteMessage, DeleteMessages)
+
+# Запросы, отправленные, пока значение True, тоже считаются фоновыми
+# (например, отложенные правки сообщений)
+background_requests: ContextVar[bool] = ContextVar('background_requests', default=False)
+
+# Сколько корзин чатов хранить; давно неиспользуемые заполнены и их можно забыть
+MAX_CHAT_BUCKETS = 10000
+
+# Ответы 429 из стольких разных чатов за FLOOD_WINDOW секунд означают общий лимит бота
+FLOOD_CHATS = 3
+FLOOD_WINDOW = 5
+
+class TokenBucket:
+    """Ограничитель частоты: rate токенов в секунду, не больше capacity подряд"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def take(self, reserve: float = 0) -> float:
+        """Берет токен и возвращает 0 или сколько секунд ждать следующего.
+
+        reserve - сколько токенов оставить нетронутыми для более важных запросов.
+        """
+        now = time.monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        needed = 1 + min(reserve, self.capacity - 1)
+        if self.tokens >= needed:
+            self.tokens -= 1
+            return 0
+        return (needed - self.tokens) / self.rate
+
+    def refund(self):
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+    def pause(self, seconds: float):
+        """Не выдает токены seconds секунд (ответ 429 с retry_after)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+        # Время паузы не копит токены, иначе после нее запросы уйдут пачкой
+        self.updated = self.paused_until
+
+class OutboundScheduler(BaseRequestMiddleware):
+    """Планировщик исходящих запросов к Bot API.
+
+    Запросы, адресованные чату (отправка, редактирование, удаление
+    сообщений), проходят через два ограничителя: общий на весь бот
+    (global_rate запросов в секунду) и отдельный для каждого чата
+    (chat_rate для личных чатов, group_rate для групп). Пока общий лимит
+    исчерпан, запросы ждут в очереди с приоритетом: ответы пользователям
+    уходят раньше фоновой очистки сообщений. Фоновые запросы не берут
+    последний токен чата, он остается для ответа пользователю.
+
+    На ответ 429 чат ставится на паузу на retry_after секунд и запрос
+    повторяется. Если за FLOOD_WINDOW секунд 429 пришел в FLOOD_CHATS
+    разных чатах, значит сработал общий лимит бота, и на паузу ставится
+    весь бот.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = 30,
+        chat_rate: float = 1,
+        chat_burst: float = 5,
+        group_rate: float = 20 / 60,
+        max_retries: int = 3
+    ):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: "OrderedDict[int, TokenBucket]" = OrderedDict()
+        # Очередь ожидающих общего лимита: (приоритет, номер, future)
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._pump_task = None
+        # Чаты, получившие 429 за последние FLOOD_WINDOW секунд: chat_id -> время
+        self._flooded_chats: "OrderedDict[int, float]" = OrderedDict()
+        self.sent = 0
+        self.throttled = 0
+        self.retries = 0
+        self.failed_retries = 0
+        self.global_pauses = 0
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            if is_group:
+                bucket = TokenBucket(self.group_rate, 1)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chats[chat_id] = bucket
+            if len(self._chats) > MAX_CHAT_BUCKETS:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    async def _wait_chat(self, chat_id, priority: int) -> TokenBucket:
+        bucket = self._chat_bucket(chat_id)
+        reserve = 1 if priority == PRIORITY_BACKGROUND else 0
+        delay = bucket.take(reserve)
+        if delay:
+            self.throttled += 1
+        while delay:
+            await asyncio.sleep(delay)
+            delay = bucket.take(reserve)
+        return bucket
+
+    def _record_flood(self, chat_id, retry_after: float):
+        """Учитывает 429 в чате и ставит на паузу весь бот, если их много в разных чатах"""
+        now = time.monotonic()
+        self._flooded_chats.pop(chat_id, None)
+        self._flooded_chats[chat_id] = now
+        while next(iter(self._flooded_chats.values())) < now - FLOOD_WINDOW:
+            self._flooded_chats.popitem(last=False)
+        if len(self._flooded_chats) >= FLOOD_CHATS:
+            self._global.pause(retry_after)
+            self.global_pauses += 1
+            self._flooded_chats.clear()
+
+    async def _wait_global(self, priority: int):
+        if not self._waiters and not self._global.take():
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        self.throttled += 1
+        if self._pump_task is None:
+            self._pump_task = asyncio.create_task(self._pump())
+        await future
+
+    async def _pump(self):
+        """Выдает общие токены ожидающим запросам в порядке приоритета"""
+        try:
+            while self._waiters:
+                delay = self._global.take()
+                if delay:
+                    await asyncio.sleep(delay)
+                    continue
+                _, _, future = heapq.heappop(self._waiters)
+                if future.done():
+                    # Запрос отменили, пока он ждал - токен не нужен
+                    self._global.refund()
+                else:
+                    future.set_result(None)
+        finally:
+            self._pump_task = None
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType]
+    ) -> Response[TelegramType]:
+        chat_id = getattr(method, 'chat_id', None)
+        if chat_id is None:
+            # getUpdates, ответы на callback и inline-запросы не ограничиваем
+            return await make_request(bot, method)
+
+        if isinstance(method, BACKGROUND_METHODS) or background_requests.get():
+            priority = PRIORITY_BACKGROUND
+        else:
+            priority = PRIORITY_INTERACTIVE
+        attempt = 0
+        while True:
+            bucket = await self._wait_chat(chat_id, priority)
+            await self._wait_global(priority)
+            try:
+                response = await make_request(bot, method)
+                self.sent += 1
+                return response
+            except TelegramRetryAfter as e:
+                attempt += 1
+                bucket.pause(e.retry_after)
+                self._record_flood(chat_id, e.retry_after)
+                if attempt > self.max_retries:
+                    self.failed_retries += 1
+                    raise
+                self.retries += 1
+                logger.error(f"Превышен лимит запросов в чате {chat_id}, повтор через {e.retry_after} с")
+
+    def stats(self) -> Dict[str, int]:
+        waiting = Counter(priority for priority, _, future in self._waiters if not future.done())
+        return {
+            'queued_interactive': waiting[PRIORITY_INTERACTIVE],
+            'queued_background': waiting[PRIORITY_BACKGROUND],
+            'sent': self.sent,
+            'throttled': self.throttled,
+            'retries': self.retries,
+            'failed_retries': self.failed_retries,
+            'global_pauses': self.global_pauses,
+            'chats': len(self._chats)
+        }
@@ -0,0 +1,169 @@
+import asyncio
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import metrics
+from async_database import claim_due_orders, mark_orders_sent, mark_order_failed
+from config import (
+    OUTBOX_POLL_INTERVAL,
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_BACKOFF_BASE,
+    OUTBOX_BACKOFF_MAX,
+    OUTBOX_LEASE,
+    OUTBOX_BATCH_WINDOW,
+    OUTBOX_BATCH_SIZE,
+    SHEETS_FORMAT_INTERVAL
+)
+from sheets import export_orders, format_new_rows, is_rejected_rows_error
+
+logger = logging.getLogger(__name__)
+
+class OrderOutbox:
+    """Фоновая выгрузка заказов в Google Таблицу.
+
+    Заказ сначала сохраняется в таблицу order_outbox, и покупатель сразу
+    получает подтверждение. Выгрузка идет в отдельном потоке, чтобы HTTP-запросы
+    к Google не останавливали цикл событий. При ошибке заказ откладывается
+    с экспоненциально растущей паузой, а после OUTBOX_MAX_ATTEMPTS попыток
+    помечается как невыгруженный (dead) и виден в админ-панели.
+
+    Новые заказы копятся OUTBOX_BATCH_WINDOW секунд и выгружаются одним
+    запросом append_rows. Форматирование строк и подбор ширины столбцов
+    выполняются отдельно, раз в SHEETS_FORMAT_INTERVAL секунд.
+    """
+
+    def __init__(self, batch_size: int = OUTBOX_BATCH_SIZE):
+        self.batch_size = batch_size
+        # Один поток: заказы выгружаются по очереди и не обгоняют друг друга
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="outbox")
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._maintenance_task: Optional[asyncio.Task] = None
+        self.exported = 0
+        self.batches = 0
+        self.failed = 0
+        self.dead = 0
+        self.formatted_rows = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            self._maintenance_task = asyncio.create_task(self._maintenance())
+
+    async def stop(self):
+        for task in (self._task, self._maintenance_task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = None
+        self._maintenance_task = None
+        # Форматируем строки, записанные после последнего обслуживания
+        await self.format_rows()
+        self._executor.shutdown(wait=True)
+
+    def notify(self):
+        """Сообщает, что в очереди появился новый заказ"""
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await self.process_due()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка при выгрузке заказов: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), OUTBOX_POLL_INTERVAL)
+                # Даем накопиться заказам, оформленным следом
+                await asyncio.sleep(OUTBOX_BATCH_WINDOW)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _maintenance(self):
+        while True:
+            await asyncio.sleep(SHEETS_FORMAT_INTERVAL)
+            await self.format_rows()
+
+    async def format_rows(self):
+        """Форматирует строки, добавленные в таблицу с прошлого раза"""
+        loop = asyncio.get_running_loop()
+        try:
+            self.formatted_rows += await loop.run_in_executor(self._executor, format_new_rows)
+        except Exception as e:
+            logger.error(f"Ошибка при форматировании таблицы заказов: {e}")
+
+    async def process_due(self):
+        """Выгружает все заказы, время попытки которых подошло"""
+        while True:
+            orders = await claim_due_orders(self.batch_size, OUTBOX_LEASE)
+            if not orders:
+                return
+            await self._export(orders)
+
+    async def _export(self, orders: List[Tuple[int, str, int]]):
+        """Выгружает пачку заказов одним запросом.
+
+        При сбое Google (сеть, 429, 5xx) попытка засчитывается всем заказам
+        пачки, и до следующей попытки запросов больше нет. Если же Google
+        отклонил данные, пачка делится пополам и выгружается по частям,
+        чтобы попытка засчитывалась только заказам, которые не принимаются.
+        """
+        payloads = []
+        valid = []
+        for order_id, payload, attempts in orders:
+            try:
+                payloads.append(json.loads(payload))
+            except ValueError as e:
+                await self._fail(order_id, attempts + 1, e)
+            else:
+                valid.append((order_id, payload, attempts))
+        if not valid:
+            return
+
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._executor, export_orders, payloads)
+        except Exception as e:
+            if len(valid) > 1 and is_rejected_rows_error(e):
+                middle = len(valid) // 2
+                await self._export(valid[:middle])
+                await self._export(valid[middle:])
+                return
+            for order_id, _, attempts in valid:
+                await self._fail(order_id, attempts + 1, e)
+        else:
+            await mark_orders_sent([order_id for order_id, _, _ in valid])
+            self.exported += len(valid)
+            self.batches += 1
+
+    async def _fail(self, order_id: int, attempts: int, error: Exception):
+        self.failed += 1
+        if attempts >= OUTBOX_MAX_ATTEMPTS:
+            next_attempt_at = None
+            self.dead += 1
+            logger.error(f"Заказ {order_id} не выгружен после {attempts} попыток: {error}")
+        else:
+            delay = min(OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1), OUTBOX_BACKOFF_MAX)
+            next_attempt_at = int(time.time() + delay)
+            logger.error(f"Ошибка при выгрузке заказа {order_id}, повтор через {delay} сек: {error}")
+        await mark_order_failed(order_id, str(error), next_attempt_at)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'exported': self.exported,
+            'batches': self.batches,
+            'failed': self.failed,
+            'dead': self.dead,
+            'formatted_rows': self.formatted_rows
+        }
+
+order_outbox = OrderOutbox()
+metrics.register("Выгрузка заказов", order_outbox.stats)
@@ -0,0 +1,88 @@
+import logging
+import os
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, InputMediaPhoto, Message
+
+from async_database import set_product_file_id
+from config import IMAGE_FOLDER
+from models import Product
+
+logger = logging.getLogger(__name__)
+
+def has_product_photo(product: Product) -> bool:
+    """Проверяет, есть ли у товара фото для отправки"""
+    if product.image_file_id:
+        return True
+    return bool(product.image_url) and os.path.exists(os.path.join(IMAGE_FOLDER, product.image_url))
+
+async def send_product_photo(
+    bot: Bot,
+    chat_id: int,
+    product: Product,
+    caption: str,
+    reply_markup=None
+) -> Optional[Message]:
+    """Отправляет фото товара.
+
+    Если Telegram уже знает фото, оно отправляется по file_id без загрузки
+    файла. Иначе файл загружается с диска, а полученный file_id сохраняется
+    для следующих показов. Возвращает None, если фото нет.
+    """
+    if product.image_file_id:
+        try:
+            return await bot.send_photo(
+                chat_id=chat_id,
+                photo=product.image_file_id,
+                caption=caption,
+                reply_markup=reply_markup
+            )
+        except TelegramBadRequest as e:
+            # file_id мог устареть - загружаем файл заново
+            logger.error(f"Не удалось отправить фото товара {product.id} по file_id: {e}")
+
+    if not product.image_url:
+        return None
+    image_path = os.path.join(IMAGE_FOLDER, product.image_url)
+    if not os.path.exists(image_path):
+        return None
+
+    sent_message = await bot.send_photo(
+        chat_id=chat_id,
+        photo=FSInputFile(image_path),
+        caption=caption,
+        reply_markup=reply_markup
+    )
+    await set_product_file_id(product.id, product.image_url, sent_message.photo[-1].file_id)
+    return sent_message
+
+async def edit_product_photo(message: Message, product: Product, caption: str, reply_markup=None) -> bool:
+    """Заменяет фото в сообщении на фото товара. Возвращает False, если отредактировать не удалось"""
+    uploaded = False
+    if product.image_file_id:
+        media = product.image_file_id
+    else:
+        if not product.image_url:
+            return False
+        image_path = os.path.join(IMAGE_FOLDER, product.image_url)
+        if not os.path.exists(image_path):
+            return False
+        media = FSInputFile(image_path)
+        uploaded = True
+
+    try:
+        result = await message.edit_media(
+            InputMediaPhoto(media=media, caption=caption),
+            reply_markup=reply_markup
+        )
+    except TelegramBadRequest as e:
+        if "message is not modified" in str(e):
+            return True
+        logger.error(f"Не удалось заменить фото товара {product.id} в сообщении: {e}")
+        return False
+
+    if uploaded and isinstance(result, Message) and result.photo:
+        await set_product_file_id(product.id, product.image_url, result.photo[-1].file_id)
+    return True
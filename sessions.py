@@ -0,0 +1,222 @@
+import asyncio
+import json
+import logging
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from async_database import load_session, save_sessions
+
+logger = logging.getLogger(__name__)
+
+def new_session() -> Dict:
+    """Возвращает пустую сессию пользователя"""
+    return {'main_message_id': None, 'other_messages': [], 'cart': {}}
+
+def _dump_session(session: Dict) -> str:
+    return json.dumps(session, ensure_ascii=False, separators=(',', ':'))
+
+def _load_session(data: str) -> Dict:
+    session = new_session()
+    session.update(json.loads(data))
+    # В JSON ключи всегда строки, а в корзине это id товаров
+    session['cart'] = {int(product_id): quantity for product_id, quantity in session['cart'].items()}
+    return session
+
+class SessionStore:
+    """Сессии пользователей с отложенной записью в базу данных.
+
+    Сессия загружается из базы при первом обращении пользователя, дальше
+    обработчики работают с ней в памяти. Измененные сессии помечаются
+    через mark_dirty и записываются в базу пачками раз в flush_interval
+    секунд (или раньше, если накопилось batch_size изменений), поэтому
+    нажатие кнопки не приводит к отдельной записи на диск.
+
+    В памяти держится не больше max_sessions сессий: после каждой записи
+    выгружаются сессии, которые простаивают дольше idle_ttl секунд, и самые
+    давние при превышении лимита. Выгружаются только уже сохраненные сессии,
+    поэтому корзина не теряется и снова загрузится из базы при обращении.
+    """
+
+    def __init__(
+        self,
+        flush_interval: float = 5.0,
+        batch_size: int = 500,
+        max_sessions: int = 10000,
+        idle_ttl: float = 3600.0
+    ):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        # Порядок - от давно не активных к недавно активным
+        self._sessions: "OrderedDict[int, Dict]" = OrderedDict()
+        self._last_seen: Dict[int, float] = {}
+        # Пользователи, чьи апдейты обрабатываются прямо сейчас
+        self._active: Counter = Counter()
+        self._dirty: Set[int] = set()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_requested = asyncio.Event()
+        self.flushes = 0
+        self.flushed_sessions = 0
+        self.loaded_sessions = 0
+        self.evicted_idle = 0
+        self.evicted_over_limit = 0
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._sessions
+
+    def __getitem__(self, user_id: int) -> Dict:
+        return self._sessions[user_id]
+
+    def __setitem__(self, user_id: int, session: Dict):
+        self._sessions[user_id] = session
+        self._touch(user_id)
+        self.mark_dirty(user_id)
+
+    def get(self, user_id: int, default=None):
+        return self._sessions.get(user_id, default)
+
+    def _touch(self, user_id: int):
+        self._sessions.move_to_end(user_id)
+        self._last_seen[user_id] = time.monotonic()
+        if len(self._sessions) > self.max_sessions:
+            self._flush_requested.set()
+
+    def mark_dirty(self, user_id: int):
+        """Отмечает сессию для записи в базу при следующем сбросе"""
+        self._dirty.add(user_id)
+        if len(self._dirty) >= self.batch_size:
+            self._flush_requested.set()
+
+    async def load(self, user_id: int) -> Dict:
+        """Возвращает сессию пользователя, при первом обращении загружая ее из базы"""
+        session = self._sessions.get(user_id)
+        if session is None:
+            data = await load_session(user_id)
+            # Пока шел запрос, сессию мог создать другой апдейт этого пользователя
+            session = self._sessions.get(user_id)
+            if session is None:
+                session = new_session()
+                if data:
+                    try:
+                        session = _load_session(data)
+                        self.loaded_sessions += 1
+                    except (ValueError, TypeError, AttributeError) as e:
+                        logger.error(f"Не удалось прочитать сессию пользователя {user_id}: {e}")
+                self._sessions[user_id] = session
+        self._touch(user_id)
+        return session
+
+    def acquire(self, user_id: int):
+        """Отмечает, что апдейт пользователя обрабатывается и сессию нельзя выгружать"""
+        self._active[user_id] += 1
+
+    def release(self, user_id: int):
+        self._active[user_id] -= 1
+        if self._active[user_id] <= 0:
+            del self._active[user_id]
+
+    def evict(self) -> int:
+        """Выгружает из памяти простаивающие сессии и лишние сессии сверх лимита"""
+        now = time.monotonic()
+        evicted = 0
+        for user_id in list(self._sessions):
+            over_limit = len(self._sessions) > self.max_sessions
+            idle = now - self._last_seen[user_id] > self.idle_ttl
+            if not over_limit and not idle:
+                # Дальше идут только более свежие сессии
+                break
+            if user_id in self._dirty or user_id in self._active:
+                # Несохраненную или используемую сессию выгрузим в следующий раз
+                continue
+            del self._sessions[user_id]
+            del self._last_seen[user_id]
+            evicted += 1
+            if idle:
+                self.evicted_idle += 1
+            else:
+                self.evicted_over_limit += 1
+        return evicted
+
+    async def flush(self):
+        """Записывает в базу все измененные сессии одной пачкой"""
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        rows = [
+            (user_id, _dump_session(self._sessions[user_id]))
+            for user_id in dirty
+            if user_id in self._sessions
+        ]
+        if await save_sessions(rows):
+            self.flushes += 1
+            self.flushed_sessions += len(rows)
+        else:
+            # Не получилось - попробуем в следующий раз
+            self._dirty.update(dirty)
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            try:
+                await self.flush()
+                self.evict()
+            except Exception as e:
+                logger.error(f"Ошибка при сохранении сессий: {e}")
+
+    async def start(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Останавливает фоновую запись и сохраняет оставшиеся изменения"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'sessions': len(self._sessions),
+            'active': len(self._active),
+            'dirty': len(self._dirty),
+            'flushes': self.flushes,
+            'flushed_sessions': self.flushed_sessions,
+            'loaded_sessions': self.loaded_sessions,
+            'evicted_idle': self.evicted_idle,
+            'evicted_over_limit': self.evicted_over_limit
+        }
+
+class SessionMiddleware(BaseMiddleware):
+    """Загружает сессию пользователя перед обработкой апдейта"""
+
+    def __init__(self, store: SessionStore):
+        self.store = store
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get('event_from_user')
+        if user is None:
+            return await handler(event, data)
+        self.store.acquire(user.id)
+        try:
+            await self.store.load(user.id)
+            return await handler(event, data)
+        finally:
+            self.store.release(user.id)
@@ -0,0 +1,166 @@
+import logging
+import re
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+import gspread
+
+import metrics
+from config import GOOGLE_SHEETS_CREDENTIALS_FILE, GOOGLE_SHEET_NAME, GOOGLE_SHEET_WORKSHEET
+
+logger = logging.getLogger(__name__)
+
+# Номера строк из диапазона вида 'Лист1'!A10:E12
+RANGE_ROWS = re.compile(r"[A-Z]+(\d+)(?::[A-Z]+(\d+))?$")
+
+# Записанные строки (первая, последняя), которые еще не отформатированы
+_new_rows: List[Tuple[int, int]] = []
+_new_rows_lock = threading.Lock()
+
+class SheetsClient:
+    """Подключение к листу Google Таблицы, общее для всех выгрузок.
+
+    Авторизация и поиск таблицы выполняются один раз при первой выгрузке.
+    Токен сервисного аккаунта google-auth обновляет сам по истечении срока.
+    После ошибки подключение сбрасывается, и следующая попытка подключается
+    заново (например, если лист переименовали). Ответы 400, 429 и 5xx
+    подключение не сбрасывают: оно исправно, и переподключение только
+    добавит запросов во время сбоя на стороне Google.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._worksheet = None
+        self.connects = 0
+        self.errors = 0
+
+    def worksheet(self) -> gspread.Worksheet:
+        with self._lock:
+            if self._worksheet is None:
+                client = gspread.service_account(filename=GOOGLE_SHEETS_CREDENTIALS_FILE)
+                self._worksheet = client.open(GOOGLE_SHEET_NAME).worksheet(GOOGLE_SHEET_WORKSHEET)
+                self.connects += 1
+            return self._worksheet
+
+    def reset(self):
+        """Сбрасывает подключение, следующий запрос подключится заново"""
+        with self._lock:
+            self._worksheet = None
+
+    def call(self, action: Callable[[gspread.Worksheet], object]):
+        """Выполняет действие с листом, при ошибке подключения сбрасывает его"""
+        worksheet = self.worksheet()
+        try:
+            return action(worksheet)
+        except Exception as e:
+            self.errors += 1
+            if not _keeps_connection(e):
+                self.reset()
+            raise
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'connects': self.connects,
+            'errors': self.errors
+        }
+
+def _api_error_code(error: Exception) -> Optional[int]:
+    if isinstance(error, gspread.exceptions.APIError):
+        return error.code
+    return None
+
+def _keeps_connection(error: Exception) -> bool:
+    code = _api_error_code(error)
+    return code is not None and (code in (400, 429) or code >= 500)
+
+def is_rejected_rows_error(error: Exception) -> bool:
+    """Google отклонил сами данные (400), и повтор той же пачки не поможет.
+
+    Сбой сервиса, лимит запросов (429, 5xx) и ошибки сети проходят сами.
+    """
+    return _api_error_code(error) == 400
+
+sheets_client = SheetsClient()
+metrics.register("Google Таблица", sheets_client.stats)
+
+def order_row(order: dict) -> List[str]:
+    """Строка таблицы для заказа, сохраненного в очереди выгрузки"""
+    products = [
+        f"• {item['name']} ({item['quantity']}шт × {item['price']}₽ = {item['quantity'] * item['price']}₽)"
+        for item in order['items']
+    ]
+    return [
+        order['created_at'],
+        order['phone'],
+        order['address'],  # Адрес (будет динамически подстраиваться)
+        "\n".join(products),  # Товары с переносами
+        f"{order['total']}₽"
+    ]
+
+def parse_updated_rows(response: dict) -> Optional[Tuple[int, int]]:
+    """Первая и последняя строка, записанные append_rows, по ответу API"""
+    updated_range = (response or {}).get('updates', {}).get('updatedRange', '')
+    match = RANGE_ROWS.search(updated_range)
+    if not match:
+        return None
+    first = int(match.group(1))
+    return first, int(match.group(2) or first)
+
+def export_orders(orders: List[dict]):
+    """Добавляет заказы в таблицу одним запросом.
+
+    Вызовы gspread блокирующие, поэтому функция выполняется в отдельном потоке.
+    Номера записанных строк берутся из ответа API, а форматирование
+    откладывается до format_new_rows.
+    """
+    rows = [order_row(order) for order in orders]
+    response = sheets_client.call(lambda sheet: sheet.append_rows(rows))
+    written = parse_updated_rows(response)
+    if written is None:
+        # Строки уже записаны, поэтому ошибку не пробрасываем - иначе заказы выгрузятся повторно
+        logger.error(f"Не удалось определить записанные строки по ответу: {response}")
+        return
+    with _new_rows_lock:
+        _new_rows.append(written)
+
+def _merge_rows(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+        else:
+            merged.append((first, last))
+    return merged
+
+def format_new_rows() -> int:
+    """Форматирует добавленные строки и подбирает ширину столбцов Адрес и Товары.
+
+    Выполняется периодически, а не после каждого заказа. Возвращает
+    количество отформатированных строк.
+    """
+    with _new_rows_lock:
+        ranges = _merge_rows(_new_rows)
+        _new_rows.clear()
+    if not ranges:
+        return 0
+
+    def apply(sheet: gspread.Worksheet):
+        # Для столбца C (Адрес) и D (Товары)
+        sheet.batch_format([
+            {
+                "range": f"C{first}:D{last}",
+                "format": {"wrapStrategy": "WRAP", "verticalAlignment": "TOP"}
+            }
+            for first, last in ranges
+        ])
+        # Автоподбор ширины только для нужных столбцов (C и D)
+        sheet.columns_auto_resize(2, 3)  # Столбцы C (2) и D (3)
+
+    try:
+        sheets_client.call(apply)
+    except Exception:
+        # Попробуем в следующий раз
+        with _new_rows_lock:
+            _new_rows.extend(ranges)
+        raise
+    return sum(last - first + 1 for first, last in ranges)
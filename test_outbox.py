@@ -0,0 +1,64 @@
+import asyncio
+import json
+import unittest
+from unittest import mock
+
+import outbox
+
+class OrderOutboxExportTest(unittest.TestCase):
+    def setUp(self):
+        self.outbox = outbox.OrderOutbox()
+        self.addCleanup(self.outbox._executor.shutdown)
+        self.failed = []
+        self.sent = []
+
+        async def mark_order_failed(order_id, error, next_attempt_at):
+            self.failed.append(order_id)
+            return True
+
+        async def mark_orders_sent(order_ids):
+            self.sent.extend(order_ids)
+            return True
+
+        for name, replacement in (('mark_order_failed', mark_order_failed), ('mark_orders_sent', mark_orders_sent)):
+            patcher = mock.patch.object(outbox, name, replacement)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def orders(self, count):
+        return [(order_id, json.dumps({'n': order_id}), 0) for order_id in range(1, count + 1)]
+
+    def export(self, orders, export_orders):
+        with mock.patch.object(outbox, 'export_orders', export_orders), \
+                mock.patch.object(outbox, 'is_rejected_rows_error', lambda e: isinstance(e, ValueError)):
+            asyncio.run(self.outbox._export(orders))
+
+    def test_outage_makes_one_call_per_batch(self):
+        export_orders = mock.Mock(side_effect=ConnectionError("Google недоступен"))
+        self.export(self.orders(16), export_orders)
+
+        self.assertEqual(export_orders.call_count, 1)
+        self.assertEqual(self.failed, list(range(1, 17)))
+        self.assertEqual(self.sent, [])
+
+    def test_rejected_rows_fail_only_their_orders(self):
+        def export_orders(payloads):
+            if any(payload['n'] == 5 for payload in payloads):
+                raise ValueError("строка отклонена")
+
+        self.export(self.orders(8), export_orders)
+
+        self.assertEqual(self.failed, [5])
+        self.assertEqual(sorted(self.sent), [1, 2, 3, 4, 6, 7, 8])
+
+    def test_corrupt_payload_fails_alone(self):
+        orders = self.orders(3) + [(4, '{broken', 0)]
+        export_orders = mock.Mock()
+        self.export(orders, export_orders)
+
+        self.assertEqual(export_orders.call_count, 1)
+        self.assertEqual(self.failed, [4])
+        self.assertEqual(sorted(self.sent), [1, 2, 3])
+
+if __name__ == "__main__":
+    unittest.main()
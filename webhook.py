@@ -0,0 +1,66 @@
+import asyncio
+import logging
+import secrets
+from typing import List
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from config import WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT
+from workers import WorkerPool
+
+logger = logging.getLogger(__name__)
+
+# Заголовок, в котором Telegram передает секрет, указанный при setWebhook
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+async def set_webhook(bot: Bot, allowed_updates: List[str]):
+    """Регистрирует адрес вебхука в Telegram, если он задан в конфиге"""
+    if not WEBHOOK_URL:
+        logger.info("WEBHOOK_URL не задан, адрес вебхука должен быть настроен заранее")
+        return
+    await bot.set_webhook(
+        url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET or None,
+        allowed_updates=allowed_updates
+    )
+
+async def _serve(app: web.Application):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    logger.info(f"Вебхук принимает апдейты на http://{WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    try:
+        # Работаем до остановки процесса
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+async def run_webhook(bot: Bot, dp: Dispatcher):
+    """Принимает апдейты через вебхук и обрабатывает их в этом процессе"""
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=WEBHOOK_SECRET or None
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    await set_webhook(bot, dp.resolve_used_update_types())
+    await _serve(app)
+
+async def run_webhook_ingress(bot: Bot, pool: WorkerPool, allowed_updates: List[str]):
+    """Принимает апдейты через вебхук и раздает их воркерам"""
+
+    async def handle(request: web.Request) -> web.Response:
+        if WEBHOOK_SECRET and not secrets.compare_digest(request.headers.get(SECRET_HEADER, ""), WEBHOOK_SECRET):
+            return web.Response(body="Unauthorized", status=401)
+        pool.check_workers()
+        pool.dispatch(await request.json())
+        return web.json_response({})
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle)
+    await set_webhook(bot, allowed_updates)
+    await _serve(app)
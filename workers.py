@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import multiprocessing
+import signal
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from aiogram import Bot, Dispatcher
+
+import metrics
+from catalog_cache import catalog_cache
+from config import WORKERS
+
+logger = logging.getLogger(__name__)
+
+# Запуск воркеров через spawn: каждый процесс заново создает бота,
+# пул соединений с базой и потоки, ничего не наследуя от ingress
+_context = multiprocessing.get_context('spawn')
+
+# Ключи апдейтов, в которых пользователь указан не в поле from
+_USER_FIELDS = ('from', 'user', 'voter_chat')
+
+def update_user_id(update: Dict[str, Any]) -> int:
+    """Возвращает id пользователя (или чата), от которого пришел апдейт"""
+    for key, event in update.items():
+        if key == 'update_id' or not isinstance(event, dict):
+            continue
+        for field in _USER_FIELDS:
+            user = event.get(field)
+            if isinstance(user, dict) and 'id' in user:
+                return user['id']
+        chat = event.get('chat') or (event.get('message') or {}).get('chat')
+        if isinstance(chat, dict) and 'id' in chat:
+            return chat['id']
+    # Апдейты без пользователя (например, poll) обрабатывает первый воркер
+    return 0
+
+def shard_for(user_id: int, workers: int) -> int:
+    """Номер воркера для пользователя: все его апдейты попадают в один процесс"""
+    return abs(user_id) % workers
+
+class WorkerPool:
+    """Процессы-обработчики апдейтов с распределением по user_id.
+
+    Ingress получает апдейты (polling или webhook) и кладет их в очередь
+    воркера, выбранного по id пользователя. Поэтому сессия, корзина и
+    состояние FSM пользователя всегда живут в одном процессе. Счетчики
+    отправленных и обработанных апдейтов лежат в общей памяти, чтобы
+    /stats в любом воркере показывал нагрузку на все процессы.
+    """
+
+    def __init__(self, target: Callable, workers: int = WORKERS):
+        self.target = target
+        self.workers = workers
+        self.queues = [_context.Queue() for _ in range(workers)]
+        self.dispatched = _context.Array('q', workers, lock=False)
+        self.processed = _context.Array('q', workers, lock=False)
+        # Общий счетчик изменений каталога для сброса кэша во всех процессах
+        self.catalog_version = _context.Value('q', 0)
+        self.processes: List[Optional[multiprocessing.Process]] = [None] * workers
+        self.restarts = 0
+
+    def _start_worker(self, index: int):
+        process = _context.Process(
+            target=self.target,
+            args=(index, self.queues[index], self.dispatched, self.processed, self.catalog_version),
+            name=f"worker-{index}",
+            daemon=True
+        )
+        process.start()
+        self.processes[index] = process
+
+    def start(self):
+        for index in range(self.workers):
+            self._start_worker(index)
+        logger.info(f"Запущено воркеров: {self.workers}")
+
+    def check_workers(self):
+        """Перезапускает упавшие процессы; их очередь при этом сохраняется"""
+        for index, process in enumerate(self.processes):
+            if process is not None and not process.is_alive():
+                logger.error(f"Воркер {index} завершился с кодом {process.exitcode}, перезапуск")
+                self.restarts += 1
+                self._start_worker(index)
+
+    def dispatch(self, update: Dict[str, Any]):
+        """Отправляет апдейт воркеру, отвечающему за его пользователя"""
+        index = shard_for(update_user_id(update), self.workers)
+        self.dispatched[index] += 1
+        self.queues[index].put(update)
+
+    async def stop(self, timeout: float = 30.0):
+        """Просит воркеры дообработать очередь и дожидается их завершения"""
+        for update_queue in self.queues:
+            update_queue.put(None)
+        loop = asyncio.get_running_loop()
+        for index, process in enumerate(self.processes):
+            if process is None:
+                continue
+            await loop.run_in_executor(None, process.join, timeout)
+            if process.is_alive():
+                logger.error(f"Воркер {index} не завершился вовремя, остановка")
+                process.terminate()
+
+def register_worker_stats(index: int, dispatched, processed):
+    """Регистрирует в /stats счетчики всех воркеров"""
+    started = time.monotonic()
+
+    def stats() -> Dict[str, int]:
+        values = {'worker': index}
+        for i in range(len(processed)):
+            values[f'worker_{i}_processed'] = processed[i]
+            values[f'worker_{i}_queued'] = dispatched[i] - processed[i]
+        values['updates_per_min'] = int(processed[index] * 60 / max(time.monotonic() - started, 1))
+        return values
+
+    metrics.register("Воркеры", stats)
+
+async def serve_updates(bot: Bot, dp: Dispatcher, index: int, update_queue, processed):
+    """Обрабатывает апдейты из очереди воркера до получения None"""
+    loop = asyncio.get_running_loop()
+    tasks = set()
+
+    async def process(update: Dict[str, Any]):
+        try:
+            await dp.feed_raw_update(bot, update)
+        except Exception as e:
+            logger.error(f"Ошибка при обработке апдейта {update.get('update_id')}: {e}")
+        finally:
+            processed[index] += 1
+
+    while True:
+        # Очередь блокирующая, ждем ее в отдельном потоке
+        update = await loop.run_in_executor(None, update_queue.get)
+        if update is None:
+            break
+        task = asyncio.create_task(process(update))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+def init_worker_process(index: int, dispatched, processed, catalog_version):
+    """Подготавливает процесс воркера: общий кэш каталога и статистика"""
+    # Остановкой управляет ingress, поэтому Ctrl+C воркеры не прерывает
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    catalog_cache.share_version(catalog_version)
+    register_worker_stats(index, dispatched, processed)
+
+async def poll_updates(bot: Bot, pool: WorkerPool, allowed_updates: List[str], polling_timeout: int = 10):
+    """Получает апдейты через getUpdates и раздает их воркерам"""
+    # Пока установлен вебхук (например, после BOT_MODE = 'webhook'), getUpdates отвечает ошибкой
+    await bot.delete_webhook(drop_pending_updates=False)
+    offset = None
+    backoff = 1
+    while True:
+        try:
+            updates = await bot.get_updates(
+                offset=offset,
+                timeout=polling_timeout,
+                allowed_updates=allowed_updates
+            )
+        except Exception as e:
+            logger.error(f"Ошибка при получении апдейтов: {e}")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+            continue
+        backoff = 1
+        pool.check_workers()
+        for update in updates:
+            offset = update.update_id + 1
+            pool.dispatch(update.model_dump(mode='json', by_alias=True, exclude_none=True))